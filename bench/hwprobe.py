@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# Hardware probe check and timings against a fake sysfs tree
+#
+# Builds a sysfs-like tree under a temporary directory with an Nvidia GPU, a
+# Broadcom wifi card and bluetooth dongle, plus N filler PCI devices, and
+# checks that:
+# - scan_pci/scan_usb read every device, and the DeviceTable lookups and the
+#   driver DB find the right ones
+# - probe() reuses its on-disk cache while the topology is the same, and
+#   scans again once a device is swapped for another one in the same slot
+# Then it prints how long a scan and a cached probe take.
+#
+# Usage: python3 bench/hwprobe.py [--devices N]
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from umstellar import driverdb, hwprobe  # noqa: E402
+
+DEVICES = 200
+
+NVIDIA_GPU = 0x2684
+BROADCOM = 0x14E4
+BROADCOM_WL = 0x43B1
+BROADCOM_BT = 0x0A5C
+
+
+def write(path: str, files: dict[str, str]):
+    os.makedirs(path, exist_ok=True)
+    for name, value in files.items():
+        with open(os.path.join(path, name), "w") as f:
+            f.write(value + "\n")
+
+
+def pci(root: str, slot: str, vendor: int, device: int, cls: int):
+    write(
+        os.path.join(root, "bus", "pci", "devices", slot),
+        {
+            "vendor": f"0x{vendor:04x}",
+            "device": f"0x{device:04x}",
+            "class": f"0x{cls:06x}",
+            "modalias": f"pci:v{vendor:08X}d{device:08X}sv00000000sd00000000"
+            f"bc{cls >> 16:02X}sc{cls >> 8 & 0xFF:02X}i{cls & 0xFF:02X}",
+        },
+    )
+
+
+def usb(root: str, name: str, vendor: int, product: int, cls: int):
+    base = os.path.join(root, "bus", "usb", "devices")
+    write(
+        os.path.join(base, name),
+        {"idVendor": f"{vendor:04x}", "idProduct": f"{product:04x}"},
+    )
+    write(
+        os.path.join(base, f"{name}:1.0"),
+        {
+            "bInterfaceClass": f"{cls >> 16:02x}",
+            "bInterfaceSubClass": f"{cls >> 8 & 0xFF:02x}",
+            "bInterfaceProtocol": f"{cls & 0xFF:02x}",
+            "modalias": f"usb:v{vendor:04X}p{product:04X}d0100dcE0dsc01dp01"
+            f"ic{cls >> 16:02X}isc{cls >> 8 & 0xFF:02X}ip{cls & 0xFF:02X}in00",
+        },
+    )
+
+
+def fake_sysfs(root: str, devices: int):
+    pci(root, "0000:01:00.0", hwprobe.NVIDIA, NVIDIA_GPU, 0x030000)
+    pci(root, "0000:02:00.0", BROADCOM, BROADCOM_WL, 0x028000)
+    for i in range(devices):
+        pci(root, f"0000:{3 + i // 32:02x}:{i % 32:02x}.0", 0x8086, 0x1000 + i, 0x060400)
+    usb(root, "1-1", BROADCOM_BT, 0x21E8, 0xE00101)
+
+
+def check(what: str, ok: bool) -> bool:
+    print(f"{'ok  ' if ok else 'FAIL'} {what}")
+    return ok
+
+
+def main():
+    devices = DEVICES
+    if "--devices" in sys.argv:
+        devices = int(sys.argv[sys.argv.index("--devices") + 1])
+    results = []
+    with tempfile.TemporaryDirectory(prefix="stellar-sysfs-") as root:
+        fake_sysfs(root, devices)
+        cache = os.path.join(root, "hwprobe.json")
+
+        start = time.perf_counter()
+        table = hwprobe.DeviceTable(hwprobe.scan_pci(root) + hwprobe.scan_usb(root))
+        scan = time.perf_counter() - start
+        results.append(check(f"scanned {len(table.devices)} devices", len(table.devices) == devices + 3))
+        gpus = table.find(vendor=hwprobe.NVIDIA, base_class=hwprobe.DISPLAY)
+        results.append(check("Nvidia GPU by vendor and class", [d.device for d in gpus] == [NVIDIA_GPU]))
+        results.append(check("wifi by class", [d.device for d in table.find(cls=0x028000)] == [BROADCOM_WL]))
+        results.append(check("bluetooth by USB vendor", len(table.find("usb", vendor=BROADCOM_BT)) == 1))
+        results.append(check("by ID", len(table.by_id.get(("pci", 0x8086, 0x1000), [])) == 1))
+        found = {drv.id for drv in driverdb.load().detect(table)}
+        results.append(check(f"drivers {sorted(found)}", found == {"nvidia", "broadcom-wl", "broadcom-bt"}))
+
+        hwprobe.probe(root, cache)
+        results.append(check("cache written", os.path.exists(cache)))
+        # same topology: a changed device file only shows up without the cache
+        write(os.path.join(root, "bus", "pci", "devices", "0000:01:00.0"), {"device": "0x1234"})
+        hwprobe.probe.cache_clear()
+        start = time.perf_counter()
+        cached = hwprobe.probe(root, cache)
+        load = time.perf_counter() - start
+        gpus = cached.find(vendor=hwprobe.NVIDIA, base_class=hwprobe.DISPLAY)
+        results.append(check("same topology reads the cache", [d.device for d in gpus] == [NVIDIA_GPU]))
+        # another card in the same slot changes the modalias, and so the hash
+        pci(root, "0000:01:00.0", hwprobe.NVIDIA, 0x1234, 0x030000)
+        hwprobe.probe.cache_clear()
+        fresh = hwprobe.probe(root, cache)
+        gpus = fresh.find(vendor=hwprobe.NVIDIA, base_class=hwprobe.DISPLAY)
+        results.append(check("swapped card scans again", [d.device for d in gpus] == [0x1234]))
+
+    print(f"scan {scan * 1000:.1f} ms, cached probe {load * 1000:.1f} ms ({devices + 3} devices)")
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# Import-time budget for the parts of Stellar that must start fast
+#
+# Every module is imported RUNS times, each in a fresh interpreter with
+# `-X importtime`, and the median is checked. This fails if that takes longer
+# than its budget, or if it drags in something that only the GUI or a network
+# check should need.
+#
+# Usage: python3 bench/importtime.py [--scale N] [--runs N]
+#   --scale multiplies every budget, for slow machines
+#   --runs  how many times to import each module
+import os
+import statistics
+import subprocess
+import sys
+
+# one import can easily take twice as long as the next on a busy machine
+RUNS = 7
+
+# cumulative import time budgets, in microseconds
+BUDGETS = {
+    "umstellar": 30_000,
+    "umstellar.apps": 60_000,
+    "umstellar.driver": 60_000,
+    "umstellar.installing": 150_000,
+    "umstellar.search": 30_000,
+}
+# modules that must stay lazily imported
+FORBIDDEN = ("gi", "requests", "asyncio", "ssl")
+# installing probes the network up front, so it's allowed to pull those in
+ALLOWED = {"umstellar.installing": ("asyncio", "ssl")}
+
+
+def importtime(module: str) -> tuple[int, set[str]]:
+    """
+    Returns the cumulative import time of a module, and everything it imported
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=root,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total = 0
+    imported = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = (x.strip() for x in line[12:].split("|"))
+        if not cumulative.isdigit():
+            continue
+        imported.add(name)
+        if name == module:
+            total = int(cumulative)
+    return total, imported
+
+
+def main():
+    scale = 1.0
+    if "--scale" in sys.argv:
+        scale = float(sys.argv[sys.argv.index("--scale") + 1])
+    runs = RUNS
+    if "--runs" in sys.argv:
+        runs = int(sys.argv[sys.argv.index("--runs") + 1])
+    failed = False
+    for module, budget in BUDGETS.items():
+        times = []
+        imported: set[str] = set()
+        for _ in range(runs):
+            total, found = importtime(module)
+            times.append(total)
+            imported |= found
+        total = int(statistics.median(times))
+        budget = int(budget * scale)
+        bad = [
+            mod
+            for mod in FORBIDDEN
+            if mod in imported and mod not in ALLOWED.get(module, ())
+        ]
+        ok = total <= budget and not bad
+        failed |= not ok
+        print(
+            f"{'ok  ' if ok else 'FAIL'} {module:<24} {total / 1000:8.1f} ms"
+            f" (median of {runs}, min {min(times) / 1000:.1f} ms,"
+            f" budget {budget / 1000:.1f} ms)"
+            + (f", imports {', '.join(bad)}" if bad else "")
+        )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
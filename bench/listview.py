@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# Build and scroll timings for a big synthetic catalog
+#
+# Puts N fake apps in one category and opens the main window on it, once with
+# the AppEntry rows and once with the Gtk.ListView page. For each one it
+# prints how long it took until the first frame was drawn, then scrolls the
+# page to the bottom a step per frame and prints the frame times.
+#
+# There's no display needed, run it under a headless compositor or Xvfb:
+#   xvfb-run python3 bench/listview.py [--apps N] [--frames N]
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# keep GL out of the numbers, it depends too much on the machine
+os.environ.setdefault("GSK_RENDERER", "cairo")
+
+from umstellar import App, Dnf, Option  # noqa: E402
+from umstellar import catalog, gui  # noqa: E402
+
+
+def synthetic(count: int) -> catalog.Catalog:
+    apps = {}
+    for i in range(count):
+        apps[f"app{i}"] = App(
+            name=f"Synthetic App {i}",
+            description=f"Benchmark app number {i}, with a description long enough to wrap",
+            payloads=[Dnf(f"synthetic-app-{i}")],
+            # every 10th app has an option, like the real catalog
+            option=Option(description="Also install extras") if i % 10 == 0 else None,
+            category="Benchmark",
+        )
+    return catalog.Catalog(apps)
+
+
+def run(mode: str, cat: catalog.Catalog, frames: int) -> tuple[float, list[float]]:
+    """
+    Returns the time to the first frame, and the scroll frame times, in ms
+    """
+    gui.LISTVIEW_MIN = 0 if mode == "listview" else len(cat.apps) + 1
+    gui.app_list.clear()
+    app = gui.Adw.Application()
+    result: dict[str, object] = {}
+
+    def on_activate(app):
+        start = time.perf_counter()
+        win = gui.MainWindow(application=app, catalog=cat)
+        win.present()
+        page = win.pages.get_visible_child()
+        scroller = page if isinstance(page, gui.Gtk.ScrolledWindow) else win.scrolled
+        clock = win.get_frame_clock()
+        times: list[float] = []
+        last = [0]
+
+        def on_paint(clock):
+            now = clock.get_frame_time()
+            if "build" not in result:
+                result["build"] = (time.perf_counter() - start) * 1000
+            elif last[0]:
+                times.append((now - last[0]) / 1000)
+            last[0] = now
+            adj = scroller.get_vadjustment()
+            step = max(adj.get_upper() / frames, 1)
+            adj.set_value(adj.get_value() + step)
+            if len(times) >= frames:
+                result["frames"] = times
+                win.destroy()
+                app.quit()
+
+        clock.connect("after-paint", on_paint)
+        # keep frames coming even when nothing else changes
+        win.add_tick_callback(lambda *_: gui.GLib.SOURCE_CONTINUE)
+
+    app.connect("activate", on_activate)
+    app.run([])
+    return result["build"], result["frames"]
+
+
+def main():
+    count = 5000
+    frames = 300
+    if "--apps" in sys.argv:
+        count = int(sys.argv[sys.argv.index("--apps") + 1])
+    if "--frames" in sys.argv:
+        frames = int(sys.argv[sys.argv.index("--frames") + 1])
+    cat = synthetic(count)
+    for mode in ("listbox", "listview"):
+        build, times = run(mode, cat, frames)
+        times.sort()
+        print(
+            f"{mode:<9} {count} apps: first frame {build:8.1f} ms,"
+            f" scroll frame mean {statistics.mean(times):.1f} ms"
+            f" p95 {times[int(len(times) * 0.95)]:.1f} ms max {times[-1]:.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
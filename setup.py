@@ -7,6 +7,7 @@ setup(
     name="umstellar",
     version="0.2.0",
     packages=find_packages(),
+    package_data={"umstellar": ["driverdb.json"]},
     entry_points={"console_scripts": []},
     install_requires=requirements,
     author="Cappy Ishihara",
@@ -1,5 +1,16 @@
-import os, logging, typing
-from . import util
+import os, typing
+
+
+def _warn(msg: str):
+    # every part of Stellar imports this package, so logging (which is slow
+    # to import) only gets pulled in once there's something to say
+    import logging
+
+    logging.warning(msg)
+
+
+class PayloadError(Exception):
+    """A payload failed to install."""
 
 
 # TODO: add app name into Payload for better progress tracking
@@ -7,13 +18,17 @@ class Payload:
     """Payload describes how a package can be installed."""
 
     priority: int = 0
+    # what the payload touches, so payloads sharing nothing can run at the
+    # same time (see scheduler.py); None means guess from the payload
+    resources: list[str] | None = None
     app: "App"
 
-    def __init__(self, prio: int = 0):
+    def __init__(self, prio: int = 0, resources: list[str] | None = None):
         self.priority = prio
+        self.resources = resources
 
-    def __call__(self):
-        logging.warn(f"{self.__repr__()} has not implemented `__call__()`.")
+    def __call__(self, on_output: typing.Callable[[str], None] | None = None):
+        _warn(f"{self.__repr__()} has not implemented `__call__()`.")
 
     def set_app(self, app: "App"):
         self.app = app
@@ -64,9 +79,6 @@ class App:
         self.category = category
         [p.set_app(self) for p in self.payloads]
 
-        logging.debug(f"App {self.name} created")
-        logging.debug(self.payloads)
-
     def __repr__(self):
         return f"App(name={self.name}, description={self.description}, payloads={self.payloads}, option={self.option}, category={self.category})"
 
@@ -94,8 +106,40 @@ class Dnf(Payload):
         self.name = name
         Payload.__init__(self, **kwargs)
 
-    def __call__(self):
-        logging.warn(f"Dnf(name='{self.name}').__call__() should not be called.")
+    def __call__(self, on_output=None):
+        _warn(f"Dnf(name='{self.name}').__call__() should not be called.")
+
+
+class DynamicDnf(Payload):
+    """
+    Represents installing dnf5 packages that are only known at install time.
+
+    The function is called once when the install is planned, and whatever it
+    returns goes into the same dnf5 transaction as the `Dnf` payloads.
+    """
+
+    f: typing.Callable[[], list[str]]
+    allowerasing: bool
+    packages: list[str] | None = None
+
+    def __init__(
+        self, f: typing.Callable[[], list[str]], allowerasing: bool = False, **kwargs
+    ):
+        self.f = f
+        self.allowerasing = allowerasing
+        Payload.__init__(self, **kwargs)
+
+    def resolve(self) -> list[str]:
+        if self.packages is None:
+            from . import trace
+
+            # these probe the hardware, see trace.py
+            with trace.span(self.f.__name__, cat="probe"):
+                self.packages = list(self.f())
+        return self.packages
+
+    def __call__(self, on_output=None):
+        _warn(f"DynamicDnf(f={self.f}).__call__() should not be called.")
 
 
 class DnfRm(Payload):
@@ -107,8 +151,8 @@ class DnfRm(Payload):
         self.name = name
         Payload.__init__(self, **kwargs)
 
-    def __call__(self):
-        logging.warn(f"DnfRm(name='{self.name}').__call__() should not be called.")
+    def __call__(self, on_output=None):
+        _warn(f"DnfRm(name='{self.name}').__call__() should not be called.")
 
 
 class Flatpak(Payload):
@@ -120,8 +164,67 @@ class Flatpak(Payload):
         self.name = name
         Payload.__init__(self, **kwargs)
 
-    def __call__(self):
-        logging.warn(f"Flatpak(name='{self.name}').__call__() should not be called.")
+    def __call__(self, on_output=None):
+        _warn(f"Flatpak(name='{self.name}').__call__() should not be called.")
+
+
+class Repo(Payload):
+    """
+    Represents adding a dnf repository.
+
+    Repos are written straight to /etc/yum.repos.d on the target, and all the
+    GPG keys get imported in one go before the dnf5 transaction.
+    """
+
+    id: str
+    name: str
+    baseurl: str
+    gpgkey: str | None
+    gpgcheck: bool
+    repo_gpgcheck: bool
+    options: dict[str, str]
+
+    def __init__(
+        self,
+        id: str,
+        baseurl: str,
+        name: str | None = None,
+        gpgkey: str | None = None,
+        gpgcheck: bool = True,
+        repo_gpgcheck: bool = False,
+        options: dict[str, str] | None = None,
+        **kwargs,
+    ):
+        self.id = id
+        self.baseurl = baseurl
+        self.name = name or id
+        self.gpgkey = gpgkey
+        self.gpgcheck = gpgcheck
+        self.repo_gpgcheck = repo_gpgcheck
+        self.options = options or {}
+        Payload.__init__(self, **kwargs)
+
+    def __repr__(self):
+        return f"Repo(id={self.id}, baseurl={self.baseurl})"
+
+    def to_ini(self) -> str:
+        lines = [
+            f"[{self.id}]",
+            f"name={self.name}",
+            f"baseurl={self.baseurl}",
+            "enabled=1",
+            f"gpgcheck={int(self.gpgcheck)}",
+        ]
+        # only when it's on, like the upstream .repo files
+        if self.repo_gpgcheck:
+            lines.append("repo_gpgcheck=1")
+        if self.gpgkey:
+            lines.append(f"gpgkey={self.gpgkey}")
+        lines.extend(f"{k}={v}" for k, v in self.options.items())
+        return "\n".join(lines) + "\n"
+
+    def __call__(self, on_output=None):
+        _warn(f"Repo(id='{self.id}').__call__() should not be called.")
 
 
 class Script(Payload):
@@ -133,10 +236,15 @@ class Script(Payload):
         self.script = script
         Payload.__init__(self, **kwargs)
 
-    def __call__(self):
-        if self.app.option is not None:
-            self.app.option.set()
-        util.execute(self.script)
+    def __call__(self, on_output: typing.Callable[[str], None] | None = None):
+        from . import util
+
+        # Scripts can run side by side, so the option goes into this script's
+        # own environment instead of os.environ
+        option = self.app.option is not None and self.app.option.option
+        env = util.payload_env() | {"STELLAR_OPTION": "1" if option else "0"}
+        if rc := util.execute(self.script, env, on_output):
+            raise PayloadError(f"Script for {self.app.name} exited with code {rc}")
 
 
 class Procedure(Payload):
@@ -148,5 +256,9 @@ class Procedure(Payload):
         self.f = f
         Payload.__init__(self, **kwargs)
 
-    def __call__(self):
+    def __call__(self, on_output: typing.Callable[[str], None] | None = None):
+        # Procedures read STELLAR_OPTION from os.environ, the scheduler never
+        # runs them next to anything else
+        if self.app.option is not None:
+            self.app.option.set()
         self.f()
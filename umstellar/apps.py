@@ -1,15 +1,7 @@
 # List of apps/presets to be installed
 
-import os
-import logging
 from . import driver
-import gi
-from gi.repository import Gtk, Adw
-from . import App, Option, Procedure, Script, Dnf, DnfRm, Flatpak
-
-gi.require_version("Gtk", "4.0")
-# libadwaita
-gi.require_version("Adw", "1")
+from . import App, Option, Procedure, Repo, Script, Dnf, DnfRm, DynamicDnf, Flatpak
 
 
 category_descriptions = {
@@ -22,7 +14,10 @@ apps = {
         name="NVIDIA Drivers",
         description="Install NVIDIA drivers",
         # Define payload, but don't run it yet
-        payloads=[Procedure(driver.setup_nvidia)],
+        payloads=[
+            DynamicDnf(driver.nvidia_packages, allowerasing=True),
+            Procedure(driver.setup_nvidia_extras, prio=1),
+        ],
         option=Option(description="Set NVIDIA GPU as primary GPU"),
         category="System",
     ),
@@ -47,18 +42,10 @@ apps = {
         name="Google Chrome",
         description="The Google Chrome web browser",
         payloads=[
-            Script(
-                """
-                echo "Installing Google Chrome"
-                cat <<EOF | sudo tee /etc/yum.repos.d/google-chrome.repo
-[google-chrome]
-name=google-chrome
-baseurl=http://dl.google.com/linux/chrome/rpm/stable/\\$basearch
-enabled=1
-gpgcheck=1
-gpgkey=https://dl-ssl.google.com/linux/linux_signing_key.pub
-EOF""",
-                prio=-10,
+            Repo(
+                "google-chrome",
+                baseurl="http://dl.google.com/linux/chrome/rpm/stable/$basearch",
+                gpgkey="https://dl-ssl.google.com/linux/linux_signing_key.pub",
             ),
             DnfRm("firefox"),
             Dnf("google-chrome-stable"),
@@ -93,12 +80,11 @@ EOF""",
         name="Visual Studio Code",
         description="Our team's IDE of choice. Simple and versatile.",
         payloads=[
-            Script(
-                """
-                sudo rpm --import https://packages.microsoft.com/keys/microsoft.asc
-                sudo sh -c 'echo -e "[code]\nname=Visual Studio Code\nbaseurl=https://packages.microsoft.com/yumrepos/vscode\nenabled=1\ngpgcheck=1\ngpgkey=https://packages.microsoft.com/keys/microsoft.asc" > /etc/yum.repos.d/vscode.repo'
-                """,
-                prio=-10,
+            Repo(
+                "code",
+                name="Visual Studio Code",
+                baseurl="https://packages.microsoft.com/yumrepos/vscode",
+                gpgkey="https://packages.microsoft.com/keys/microsoft.asc",
             ),
             Dnf("code"),
         ],
@@ -108,12 +94,13 @@ EOF""",
         name="VSCodium",
         description="Visual Studio Code, without Microsoft",
         payloads=[
-            Script(
-                """
-                sudo rpmkeys --import https://gitlab.com/paulcarroty/vscodium-deb-rpm-repo/-/raw/master/pub.gpg
-                printf "[gitlab.com_paulcarroty_vscodium_repo]\nname=download.vscodium.com\nbaseurl=https://download.vscodium.com/rpms/\nenabled=1\ngpgcheck=1\nrepo_gpgcheck=1\ngpgkey=https://gitlab.com/paulcarroty/vscodium-deb-rpm-repo/-/raw/master/pub.gpg\nmetadata_expire=1h" | sudo tee -a /etc/yum.repos.d/vscodium.repo
-                """,
-                prio=-10,
+            Repo(
+                "gitlab.com_paulcarroty_vscodium_repo",
+                name="download.vscodium.com",
+                baseurl="https://download.vscodium.com/rpms/",
+                gpgkey="https://gitlab.com/paulcarroty/vscodium-deb-rpm-repo/-/raw/master/pub.gpg",
+                repo_gpgcheck=True,
+                options={"metadata_expire": "1h"},
             ),
             Dnf("codium"),
         ],
@@ -123,11 +110,16 @@ EOF""",
         name="Tailscale",
         description="VPN for simulating LAN",
         payloads=[
-            Script(
-                """
-                sudo dnf config-manager --add-repo https://pkgs.tailscale.com/stable/fedora/tailscale.repo
-                """,
-                prio=-10,
+            # same as upstream's tailscale.repo: the key signs the repo
+            # metadata, the packages themselves aren't signed
+            Repo(
+                "tailscale-stable",
+                name="Tailscale stable",
+                baseurl="https://pkgs.tailscale.com/stable/fedora/$basearch",
+                gpgkey="https://pkgs.tailscale.com/stable/fedora/repo.gpg",
+                gpgcheck=False,
+                repo_gpgcheck=True,
+                options={"type": "rpm"},
             ),
             Dnf("tailscale"),
             Script("sudo systemctl enable tailscale", prio=1),
@@ -138,12 +130,11 @@ EOF""",
         name="Microsoft Edge",
         description="Microsoft Edge web browser",
         payloads=[
-            Script(
-                """
-                sudo rpm --import https://packages.microsoft.com/keys/microsoft.asc
-                sudo dnf config-manager --add-repo https://packages.microsoft.com/yumrepos/edge
-                """,
-                prio=-10,
+            Repo(
+                "packages.microsoft.com_yumrepos_edge",
+                name="Microsoft Edge",
+                baseurl="https://packages.microsoft.com/yumrepos/edge",
+                gpgkey="https://packages.microsoft.com/keys/microsoft.asc",
             ),
             Dnf("microsoft-edge-stable"),
         ],
@@ -201,17 +192,10 @@ EOF""",
         name="Warp",
         description="Modern terminal with quality of life tweaks and AI features. A favourite of our team. x86 only!",
         payloads=[
-            Script(
-                """
-                sudo tee /etc/yum.repos.d/warpdotdev.repo
-                [warpdotdev]
-                name=warpdotdev
-                baseurl=https://releases.warp.dev/linux/rpm/stable
-                enabled=1
-                gpgcheck=1
-                gpgkey=https://releases.warp.dev/linux/keys/warp.asc
-                """,
-                prio=-10,
+            Repo(
+                "warpdotdev",
+                baseurl="https://releases.warp.dev/linux/rpm/stable",
+                gpgkey="https://releases.warp.dev/linux/keys/warp.asc",
             ),
             Dnf("warp"),
         ],
@@ -453,12 +437,12 @@ EOF""",
         option=Option(description="Also install 1Password CLI"),
         category="apps",
         payloads=[
-            Script(
-                """
-                rpm --import https://downloads.1password.com/linux/keys/1password.asc
-                sh -c 'echo -e "[1password]\nname=1Password Stable Channel\nbaseurl=https://downloads.1password.com/linux/rpm/stable/\\$basearch\nenabled=1\ngpgcheck=1\nrepo_gpgcheck=1\ngpgkey=\"https://downloads.1password.com/linux/keys/1password.asc\"" > /etc/yum.repos.d/1password.repo'
-                """,
-                prio=-10,
+            Repo(
+                "1password",
+                name="1Password Stable Channel",
+                baseurl="https://downloads.1password.com/linux/rpm/stable/$basearch",
+                gpgkey="https://downloads.1password.com/linux/keys/1password.asc",
+                repo_gpgcheck=True,
             ),
             Dnf("1password"),
             Script("""
@@ -471,25 +455,25 @@ EOF""",
     "broadcom": App(
         name="Broadcom Drivers",
         description="Broadcom wifi and bluetooth drivers",
-        payloads=[Procedure(driver.setup_broadcom)],
+        payloads=[DynamicDnf(driver.broadcom_packages)],
         category="drivers",
     ),
     "v4l2loopback": App(
         name="v4l2loopback",
         description="Virtual webcam and video loopback driver",
-        payloads=[Dnf("akmod-v4l2loopback")],
+        payloads=[DynamicDnf(driver.v4l2loopback_packages)],
         category="drivers",
     ),
     "crystalhd": App(
         name="Crystal HD",
         description="Broadcom Crystal HD video decoder driver",
-        payloads=[Dnf("akmod-crystalhd")],
+        payloads=[DynamicDnf(driver.crystalhd_packages)],
         category="drivers",
     ),
     "intel-ipu6": App(
         name="Intel IPU6 Drivers",
         description="Intel IPU6 component for MIPI camera support on Intel Tiger Lake, Alder Lake, and beyond",
-        payloads=[Dnf("akmod-intel-ipu6")],
+        payloads=[DynamicDnf(driver.intel_ipu6_packages)],
         category="drivers",
     ),
     "prismlauncher": App(
@@ -620,51 +604,10 @@ category_icons = {
 }
 
 
-class AppEntry(Adw.ExpanderRow):
-    def __init__(self, app: App, id: str):
-        super().__init__(enable_expansion=False)
-        self.app = app
-        self.appid = id
-        self.set_title(app.name)
-        self.set_subtitle(app.description)
-        self.set_activatable(False)
-        self.connect("activate", self.on_activate)
-
-        # add tickbox to the right
-        self.tickbox = Gtk.CheckButton()
-        self.tickbox.connect("toggled", self.on_tickbox_toggled)
-
-        # add as suffix
-        self.add_prefix(self.tickbox)
-
-        if not app.option:
-            # hide enable expansion button if there's no option
-            self.set_show_enable_switch(False)
-
-        if app.option:
-            # Prefix, for the feature flags
-            # set sensitive to whatever the tickbox status is by connecting it
-            act = app.option.option
-            self.option_toggle = Gtk.CheckButton(
-                # sensitive=act, active=act,
-                margin_start=10,
-                margin_end=10,
-                margin_bottom=5,
-                margin_top=5,
-            )
-
-            # add option toggle as suffix
-            self.optionbox = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
-            self.desc_label = Gtk.Label(
-                css_classes=["h4"], label=app.option.description
-            )
-            self.optionbox.append(self.option_toggle)
-            self.optionbox.append(self.desc_label)
-            self.add_row(self.optionbox)
-
-    def on_activate(self, _):
-        logging.debug(f"Activating {self.app.name}")
+def __getattr__(name: str):
+    # the widget used to live here, but the catalog shouldn't need GTK
+    if name == "AppEntry":
+        from .gui import AppEntry
 
-    def on_tickbox_toggled(self, tickbox):
-        if self.app.option:
-            self.set_enable_expansion(self.tickbox.get_active())
+        return AppEntry
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,157 @@
+# Capturing what dnf5, flatpak and friends print
+#
+# A big dnf5 transaction (akmods building kernel modules, for one) prints a
+# lot, and keeping all of it in memory just to maybe show it on failure adds
+# up. A Transcript keeps the last RING_LINES lines of each stream in memory,
+# for error messages and the UI, and streams everything to a gzipped log
+# under LOG_DIR. Whoever wants the whole thing reads it back from there, line
+# by line. Only the newest LOG_KEEP logs are kept, older ones get deleted
+# when a new one is opened.
+#
+# The log lines are tagged with the stream they came from:
+#
+#   out | [ 1/12] steam-1.0.0.78-1.fc39.i686.rpm  100% | 1.2 MiB/s
+#   err | Warning: skipped OpenPGP checks for 1 package
+import gzip
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import Iterator
+
+LOG_DIR = os.environ.get("STELLAR_LOG_DIR", "/var/log/stellar")
+# where logs go when LOG_DIR isn't writable, i.e. not running as root
+USER_LOG_DIR = os.path.join(
+    os.environ.get("XDG_STATE_HOME") or os.path.expanduser("~/.local/state"),
+    "stellar",
+)
+RING_LINES = int(os.environ.get("STELLAR_RING_LINES", "200"))
+# an install writes a few logs, this is a good number of installs back
+LOG_KEEP = int(os.environ.get("STELLAR_LOG_KEEP", "100"))
+
+STREAMS = ("out", "err")
+_TAG = re.compile(r"^(out|err) \| ")
+# only one transcript gets to warn about the log dir
+_warned = threading.Event()
+
+
+def prune(d: str, keep: int = LOG_KEEP):
+    """
+    Deletes all but the newest `keep` logs in a directory
+    """
+    try:
+        with os.scandir(d) as it:
+            logs = [e for e in it if e.name.endswith(".log.gz") and e.is_file()]
+        if len(logs) <= keep:
+            return
+        # newest first, by name (it starts with the time) and then mtime
+        logs.sort(key=lambda e: (e.name[:15], e.stat().st_mtime), reverse=True)
+    except OSError:
+        return
+    for e in logs[keep:]:
+        try:
+            os.unlink(e.path)
+        except OSError as err:
+            logging.debug(f"Cannot delete old log {e.path}: {err}")
+
+
+def open_log(name: str) -> tuple[str, gzip.GzipFile] | None:
+    """
+    Returns the path and file of a new gzipped log, or None if there's
+    nowhere to put one
+    """
+    prefix = f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-"
+    for d in (LOG_DIR, USER_LOG_DIR):
+        try:
+            os.makedirs(d, exist_ok=True)
+            fd, path = tempfile.mkstemp(prefix=prefix, suffix=".log.gz", dir=d)
+        except OSError:
+            continue
+        prune(d)
+        return path, gzip.GzipFile(fileobj=os.fdopen(fd, "wb"), mode="wb")
+    if not _warned.is_set():
+        _warned.set()
+        logging.warning(f"Cannot write logs to {LOG_DIR} or {USER_LOG_DIR}")
+    return None
+
+
+class Transcript:
+    """
+    The output of one command: the last lines in memory, all of it on disk
+    """
+
+    name: str
+    path: str | None
+    tail: dict[str, deque[str]]
+
+    def __init__(self, name: str, ring: int = RING_LINES):
+        self.name = name
+        self.tail = {stream: deque(maxlen=ring) for stream in STREAMS}
+        log = open_log(name)
+        self.path, self.file = log if log else (None, None)
+
+    def __repr__(self):
+        return f"Transcript(name={self.name}, path={self.path})"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def write(self, stream: str, lines: list[str]):
+        self.tail[stream].extend(lines)
+        if self.file:
+            self.file.write(
+                "".join(f"{stream} | {line}\n" for line in lines).encode(
+                    errors="replace"
+                )
+            )
+
+    def close(self):
+        if self.file:
+            # GzipFile doesn't close a fileobj it was given
+            fileobj = self.file.fileobj
+            self.file.close()
+            fileobj.close()
+            self.file = None
+
+    def recent(self, stream: str = "err", n: int | None = None) -> list[str]:
+        """
+        Returns the last n lines kept in memory for a stream
+        """
+        lines = list(self.tail[stream])
+        return lines if n is None else lines[-n:]
+
+    def lines(self, stream: str | None = None) -> Iterator[str]:
+        """
+        Yields every line of a stream, or of both streams in the order they
+        came in, from the log on disk
+
+        Without a log, that's only what's still in memory.
+        """
+        if self.path is None:
+            for s in STREAMS if stream is None else (stream,):
+                yield from self.tail[s]
+            return
+        if self.file:
+            # let the reader see everything written so far
+            self.file.flush()
+        with gzip.open(self.path, "rt", errors="replace") as f:
+            try:
+                for line in f:
+                    if (m := _TAG.match(line)) and stream in (None, m[1]):
+                        yield line[m.end() :].rstrip("\n")
+            except EOFError:
+                # still being written, so there's no gzip trailer yet
+                pass
+
+    def text(self, stream: str | None = None) -> str:
+        """
+        Returns the whole output as one string, don't use this on something
+        that might be huge
+        """
+        return "\n".join(self.lines(stream))
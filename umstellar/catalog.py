@@ -0,0 +1,188 @@
+# The app catalog: the built-in apps from apps.py, plus drop-in TOML files
+#
+# Drop-ins live in /usr/share/stellar/apps.d/*.toml (STELLAR_APPS_D), one
+# table per app, and override built-in apps with the same ID:
+#
+#   [foo]
+#   name = "Foo"
+#   description = "Does foo things"
+#   category = "Development"
+#   option = "Also install the foo CLI"  # optional
+#
+#   [[foo.payloads]]
+#   type = "dnf"  # or "dnfrm", "flatpak", "repo", "script"
+#   name = "foo"
+#
+#   [[foo.payloads]]
+#   type = "repo"
+#   id = "foo"
+#   baseurl = "https://example.com/foo/$basearch"
+#   gpgkey = "https://example.com/foo.asc"
+#
+# Everything is compiled into a Catalog with a table by category, and pickled to a
+# snapshot that is reused as long as Stellar's own code and the drop-ins are
+# unchanged, so neither apps.py nor the TOML files need to be loaded on most
+# runs.
+#
+# Unpickling runs code, and the scripts in the catalog end up running as
+# root, so the snapshot is only written by root and only read if root owns it
+# and nobody else can write to it or its directory. Other users just build
+# the catalog every time.
+import functools
+import hashlib
+import logging
+import os
+import pickle
+import tomllib
+
+from . import App, Dnf, DnfRm, Flatpak, Option, Payload, Repo, Script, trace
+
+APPS_D = os.environ.get("STELLAR_APPS_D", "/usr/share/stellar/apps.d")
+SNAPSHOT = "/var/cache/stellar/catalog.pickle"
+# bump when the Catalog layout changes, so old snapshots get thrown away
+VERSION = 3
+
+PAYLOADS: dict[str, type[Payload]] = {
+    "dnf": Dnf,
+    "dnfrm": DnfRm,
+    "flatpak": Flatpak,
+    "repo": Repo,
+    "script": Script,
+}
+
+
+class Catalog:
+    """All apps, with a lookup table by category."""
+
+    apps: dict[str, App]
+    by_category: dict[str, dict[str, App]]
+
+    def __init__(self, apps: dict[str, App]):
+        self.apps = apps
+        self.by_category = {}
+        for id, app in apps.items():
+            # apps without a category go under "Utilities"
+            self.by_category.setdefault(app.category or "Utilities", {})[id] = app
+
+    def categories(self) -> list[str]:
+        return sorted(self.by_category)
+
+    def category(self, cat: str) -> dict[str, App]:
+        return self.by_category.get(cat, {})
+
+
+def parse(path: str) -> dict[str, App]:
+    """
+    Returns the apps defined in a TOML drop-in
+    """
+    with open(path, "rb") as f:
+        data = tomllib.load(f)
+    apps = {}
+    for id, entry in data.items():
+        payloads = []
+        for p in entry.get("payloads", []):
+            kwargs = dict(p)
+            cls = PAYLOADS[kwargs.pop("type")]
+            payloads.append(cls(**kwargs))
+        option = entry.get("option")
+        apps[id] = App(
+            name=entry["name"],
+            description=entry.get("description", ""),
+            payloads=payloads,
+            option=Option(description=option) if option else None,
+            category=entry.get("category"),
+        )
+    return apps
+
+
+def dropins(apps_d: str = APPS_D) -> list[str]:
+    try:
+        names = sorted(n for n in os.listdir(apps_d) if n.endswith(".toml"))
+    except OSError:
+        return []
+    return [os.path.join(apps_d, n) for n in names]
+
+
+def snapshot_key(files: list[str]) -> str:
+    """
+    Returns a key that changes whenever any of Stellar's modules or any
+    drop-in changes
+    """
+    h = hashlib.sha256(f"{VERSION}\n".encode())
+    # not just apps.py, the payload classes and the functions the apps call
+    # get pickled too
+    here = os.path.dirname(os.path.abspath(__file__))
+    sources = sorted(
+        os.path.join(here, n) for n in os.listdir(here) if n.endswith(".py")
+    )
+    for path in [*sources, *files]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        h.update(f"{path}\0{st.st_mtime_ns}\0{st.st_size}\n".encode())
+    return h.hexdigest()
+
+
+def _trusted(st: os.stat_result) -> bool:
+    # owned by root, and only root can change it
+    return st.st_uid == 0 and not st.st_mode & 0o022
+
+
+def read_snapshot(snapshot: str) -> tuple[str, Catalog] | None:
+    """
+    Returns the key and catalog of a snapshot, if there's one we can trust
+    """
+    try:
+        if not _trusted(os.stat(os.path.dirname(snapshot))):
+            return None
+        fd = os.open(snapshot, os.O_RDONLY | os.O_NOFOLLOW)
+    except OSError:
+        return None
+    with os.fdopen(fd, "rb") as f:
+        if not _trusted(os.fstat(fd)):
+            logging.warning(f"Ignoring catalog snapshot {snapshot}, only root may own and write it")
+            return None
+        return pickle.load(f)
+
+
+def build(files: list[str]) -> Catalog:
+    from .apps import apps as builtin
+
+    apps = dict(builtin)
+    for path in files:
+        try:
+            apps.update(parse(path))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning(f"Ignoring broken catalog file {path}: {e}")
+    return Catalog(apps)
+
+
+@functools.cache
+@trace.traced("catalog.load", cat="startup")
+def load(apps_d: str = APPS_D, snapshot: str | None = SNAPSHOT) -> Catalog:
+    """
+    Returns the catalog, from the snapshot if it is still up to date
+    """
+    files = dropins(apps_d)
+    key = snapshot_key(files)
+    if snapshot:
+        try:
+            if (cached := read_snapshot(snapshot)) and cached[0] == key:
+                return cached[1]
+        except Exception:
+            # broken or from an older Stellar, just rebuild it
+            pass
+    catalog = build(files)
+    # only root writes it, see the top of this file
+    if snapshot and os.geteuid() == 0:
+        try:
+            os.makedirs(os.path.dirname(snapshot), exist_ok=True)
+            tmp = f"{snapshot}.{os.getpid()}"
+            with open(tmp, "wb") as f:
+                os.fchmod(f.fileno(), 0o644)
+                pickle.dump((key, catalog), f)
+            os.replace(tmp, snapshot)
+        except Exception as e:
+            logging.debug(f"Cannot write catalog snapshot {snapshot}: {e}")
+    return catalog
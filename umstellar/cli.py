@@ -0,0 +1,216 @@
+# Command line interface, for kickstarts and provisioning scripts
+#
+#   python -m umstellar                  the GUI, like before
+#   python -m umstellar list             lists the apps in the catalog
+#   python -m umstellar install --apps steam,vscode,nvidia --option nvidia=on --yes
+#   python -m umstellar install --selection selection.toml --yes
+#   python -m umstellar install --apps steam,vscode --dry-run   prints the plan
+#   python -m umstellar install --resume --yes   finishes an interrupted install
+#
+# A selection file is TOML, with the app IDs and their options:
+#
+#   apps = ["steam", "vscode", "nvidia"]
+#
+#   [options]
+#   nvidia = true
+#
+# Nothing in here imports GTK, so it runs fine without a display server.
+import argparse
+import json
+import logging
+import sys
+import tomllib
+
+from . import App, PayloadError, catalog, journal
+
+ON = ("on", "true", "yes", "1")
+OFF = ("off", "false", "no", "0")
+
+
+def parse_option(value: str) -> tuple[str, bool]:
+    id, _, state = value.partition("=")
+    state = state.lower() or "on"
+    if state not in ON + OFF:
+        raise argparse.ArgumentTypeError(f"expected {id}=on or {id}=off, got {value!r}")
+    return id, state in ON
+
+
+def read_selection(path: str) -> tuple[list[str], dict[str, bool]]:
+    """
+    Returns the app IDs and options from a selection file
+    """
+    with open(path, "rb") as f:
+        data = tomllib.load(f)
+    options = {id: bool(state) for id, state in data.get("options", {}).items()}
+    return list(data.get("apps", [])), options
+
+
+def write_selection(path: str, selected: dict[str, App]):
+    """
+    Writes a selection file that read_selection() reads back
+    """
+    lines = [f"apps = {json.dumps(list(selected))}", "", "[options]"]
+    for id, app in selected.items():
+        if app.option:
+            lines.append(f"{json.dumps(id)} = {'true' if app.option.option else 'false'}")
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def select(
+    cat: catalog.Catalog, ids: list[str], options: dict[str, bool]
+) -> dict[str, App]:
+    """
+    Returns the selected apps, with their options set
+
+    Raises KeyError with the IDs that aren't in the catalog.
+    """
+    unknown = [id for id in [*ids, *options] if id not in cat.apps]
+    if unknown:
+        raise KeyError(", ".join(dict.fromkeys(unknown)))
+    selected = {id: cat.apps[id] for id in dict.fromkeys(ids)}
+    for id, state in options.items():
+        if id not in selected:
+            logging.warning(f"Option for {id} given, but it's not selected")
+        elif not cat.apps[id].option:
+            logging.warning(f"{id} has no option, ignoring it")
+        else:
+            cat.apps[id].option.option = state
+    return selected
+
+
+def confirm(selected: dict[str, App]) -> bool:
+    print("These apps will be installed:")
+    for id, app in selected.items():
+        opt = f" (+ {app.option.description})" if app.option and app.option.option else ""
+        print(f"  {id}: {app.name}{opt}")
+    if not sys.stdin.isatty():
+        print("Not asking without a terminal, pass --yes to install", file=sys.stderr)
+        return False
+    return input("Continue? [y/N] ").strip().lower() in ("y", "yes")
+
+
+def cmd_list(args: argparse.Namespace) -> int:
+    cat = catalog.load()
+    for category in cat.categories():
+        print(f"{category}:")
+        for id, app in cat.category(category).items():
+            opt = f" [option: {app.option.description}]" if app.option else ""
+            print(f"  {id:<24} {app.name}{opt}")
+    return 0
+
+
+def cmd_install(args: argparse.Namespace) -> int:
+    ids = [id.strip() for ids in args.apps for id in ids.split(",") if id.strip()]
+    options = dict(args.option)
+    if args.selection:
+        try:
+            file_ids, file_options = read_selection(args.selection)
+        except (OSError, tomllib.TOMLDecodeError) as e:
+            args.parser.error(f"cannot read {args.selection}: {e}")
+        ids = [*file_ids, *ids]
+        # command line options win over the file
+        options = file_options | options
+    if args.resume:
+        if not (unfinished := journal.pending()):
+            print("No unfinished install to resume")
+            return 0
+        ids = [*unfinished.apps, *ids]
+        options = unfinished.options | options
+    if not ids:
+        args.parser.error("nothing to install, pass --apps or --selection")
+    try:
+        selected = select(catalog.load(), ids, options)
+    except KeyError as e:
+        args.parser.error(f"unknown apps: {e.args[0]}")
+    if args.dry_run:
+        # log sets up the handlers, it has to be imported before moving them
+        from . import log, plan
+
+        # keep stdout for the JSON
+        for handler in logging.getLogger().handlers:
+            if isinstance(handler, logging.StreamHandler):
+                handler.setStream(sys.stderr)
+        print(plan.build(selected).to_json())
+        return 0
+    if not args.yes and not confirm(selected):
+        return 1
+
+    from . import installing, progress
+
+    if args.progress_fd is not None:
+        progress.open_fd(args.progress_fd)
+    rc = 0
+    try:
+        installing.process_installs(selected)
+    except PayloadError as e:
+        logging.error(f"Install failed: {e}")
+        rc = 1
+    progress.emit({"event": "finished", "rc": rc})
+    return rc
+
+
+def cmd_gui(args: argparse.Namespace) -> int:
+    # GTK takes a while to load, so only pull it in once we know we need it
+    from . import gui
+
+    return gui.main()
+
+
+def parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(
+        prog="umstellar", description="Ultramarine Quickstart Tool"
+    )
+    p.set_defaults(func=cmd_gui, parser=p)
+    sub = p.add_subparsers(title="commands")
+
+    lst = sub.add_parser("list", help="list the apps that can be installed")
+    lst.set_defaults(func=cmd_list, parser=lst)
+
+    ins = sub.add_parser("install", help="install apps without the GUI")
+    ins.add_argument(
+        "--apps",
+        action="append",
+        default=[],
+        metavar="ID[,ID...]",
+        help="apps to install, by ID (see `umstellar list`)",
+    )
+    ins.add_argument(
+        "--option",
+        action="append",
+        default=[],
+        type=parse_option,
+        metavar="ID=on|off",
+        help="turn an app's option on or off",
+    )
+    ins.add_argument(
+        "--selection",
+        metavar="FILE",
+        help="TOML file with the apps and options to install",
+    )
+    ins.add_argument(
+        "--resume",
+        action="store_true",
+        help="install the apps of an interrupted install again, skipping what it finished",
+    )
+    ins.add_argument(
+        "-y", "--yes", action="store_true", help="don't ask before installing"
+    )
+    ins.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="print the install plan as JSON instead of installing",
+    )
+    ins.add_argument(
+        "--progress-fd",
+        type=int,
+        metavar="FD",
+        help="write progress events as JSON lines to this file descriptor",
+    )
+    ins.set_defaults(func=cmd_install, parser=ins)
+    return p
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parser().parse_args(argv)
+    return args.func(args)
@@ -2,82 +2,55 @@
 from . import log
 import logging
 import os
-import subprocess
-import requests
-from . import util
-
-nvidia_prefixes = {
-    # List of chipset prefixes with its corresponding last supported driver version
-    # if it's not in the list, it's probably supported by the latest driver
-    # but... if it's really really old, then you're out of luck
-    # We're gonna be supporting GPUs from the 8000 series and up
-    "NV": "unsupported",
-    "MCP": "unsupported",
-    "G7": "unsupported",
-    "G8": "340xx",
-    # wtf this goes from like 8000 to 100 series
-    "G9": "340xx",
-    # finally, a sane naming scheme
-    # Tesla GPUs
-    "GT": "340xx",
-    # Fermi GPUs, in case you like burning your house down
-    "GF": "390xx",
-    # Kepler GPUs
-    # now we're finally up to the modern era
-    "GK": "470xx",
-    # The rest should be supported by the latest driver, at least as of
-    # late 2023
-}
+from . import driverdb, hwprobe, pkgcache, util
 
 
 def get_nvidia_driver(chipset: str) -> str:
     """
     Returns the latest supported driver for the given chipset
-    """
-    for prefix, driver in nvidia_prefixes.items():
-        if chipset.startswith(prefix):
-            return driver
-    return "latest"
-
 
-# tests
-
-assert get_nvidia_driver("NV34") == "unsupported"
-assert get_nvidia_driver("GK104") == "470xx"
-assert get_nvidia_driver("GP108") == "latest"
-assert get_nvidia_driver("GK208") == "470xx"
-assert get_nvidia_driver("GT218") == "340xx"
+    >>> get_nvidia_driver("NV34")
+    'unsupported'
+    >>> get_nvidia_driver("GK104")
+    '470xx'
+    >>> get_nvidia_driver("GP108")
+    'latest'
+    >>> get_nvidia_driver("GK208")
+    '470xx'
+    >>> get_nvidia_driver("GT218")
+    '340xx'
+    """
+    # chipset prefixes and their last supported driver now live in driverdb.json
+    return driverdb.load().chipset_branch(chipset)
 
 
 def check_internet_connection() -> bool:
     """
     Returns True if an internet connection is available
     """
-    try:
-        requests.get("https://ultramarine-linux.org")
-        return True
-    except requests.exceptions.ConnectionError:
-        return False
+    # asyncio and ssl are slow to import, and most runs never get here
+    from . import netprobe
+
+    return netprobe.online()
 
 
 def check_nvidia_gpu() -> bool:
     """
     Returns True if an Nvidia GPU is installed
     """
-    # lspci | grep -q -i NVIDIA
-
-    return subprocess.call("lspci | grep -q -i NVIDIA", shell=True) == 0
+    return driverdb.detected("nvidia")
 
 
 def get_nvidia_chipset() -> str:
     """
     Returns the chipset of the installed Nvidia GPU
     """
-    # something with lspci and grep idk
-    gpu = subprocess.getoutput(
-        "lspci | grep -i NVIDIA | head -n 1 | cut -d ':' -f 3 | cut -d '[' -f 1 | sed -e 's/^[[:space:]]*//'",
-    ).split()[-1]
-    return gpu
+    # pci.ids names them like "GK104 [GeForce GTX 680]", same as lspci
+    gpus = hwprobe.probe().find(vendor=hwprobe.NVIDIA, base_class=hwprobe.DISPLAY)
+    if not gpus:
+        return ""
+    name = hwprobe.pci_device_names(hwprobe.NVIDIA).get(gpus[0].device, "")
+    return (name.split("[")[0].split() or [""])[-1]
 
 
 def get_nvidia_packages() -> list[str]:
@@ -85,27 +58,21 @@ def get_nvidia_packages() -> list[str]:
     Returns a list of Nvidia packages to install
     """
 
-    pkgs = ["nvidia-gpu-firmware", "libva-nvidia-driver"]
-    chipset = get_nvidia_chipset()
-    ver = get_nvidia_driver(chipset)
+    db = driverdb.load()
+    pkgs = db.packages("nvidia")
+    gpus = hwprobe.probe().find(vendor=hwprobe.NVIDIA, base_class=hwprobe.DISPLAY)
+    # known device IDs first, the chipset name only for the ones not listed
+    ver = None
+    if gpus:
+        ver = db.device_branch(gpus[0].device)
+    if ver is None:
+        ver = get_nvidia_driver(get_nvidia_chipset())
 
     if ver == "unsupported":
         logging.warning("Unsupported NVIDIA GPU detected, keeping nouveau drivers")
-        return pkgs
-
-    if ver == "latest":
-        pkgs.extend(["akmod-nvidia", "xorg-x11-drv-nvidia", "xorg-x11-drv-nvidia-cuda"])
-        return pkgs
 
-    else:
-        pkgs.extend(
-            [
-                f"akmod-nvidia-{ver}",
-                f"xorg-x11-drv-nvidia-{ver}",
-                f"xorg-x11-drv-nvidia-{ver}-cuda",
-            ]
-        )
-        return pkgs
+    pkgs.extend(db.nvidia_packages(ver))
+    return pkgs
 
 
 def check_ostree() -> bool:
@@ -142,15 +109,35 @@ def setup_nvidia_ostree():
     logging.info("Complete! Please reboot to apply changes.")
 
 
-def setup_nvidia(primary_gpu: bool = False):
+def nvidia_packages() -> list[str]:
+    """
+    Returns the Nvidia packages to add to the install transaction
+
+    Returns nothing if there is no Nvidia GPU, or on OSTree, where
+    `setup_nvidia_extras()` layers the packages with rpm-ostree instead.
+    """
+    if not check_nvidia_gpu():
+        logging.warning("No Nvidia GPU detected, skipping Nvidia driver setup")
+        return []
+
+    if check_ostree():
+        return []
+
+    pkgs = get_nvidia_packages()
+    logging.info(f"Installing Nvidia packages: {pkgs}")
+    return pkgs
+
+
+def setup_nvidia_extras(primary_gpu: bool = False):
+    """
+    Everything Nvidia driver setup needs besides installing the packages
+    """
     # Set to True anyway if STELLAR_OPTION is set to 1
     primary_gpu = False
     if "STELLAR_OPTION" in os.environ and os.environ["STELLAR_OPTION"] == "1":
         primary_gpu = True
 
-    # Set up NVIDIA drivers, if applicable
     if not check_nvidia_gpu():
-        logging.warning("No Nvidia GPU detected, skipping Nvidia driver setup")
         return
 
     if check_ostree():
@@ -158,17 +145,6 @@ def setup_nvidia(primary_gpu: bool = False):
         setup_nvidia_ostree()
         return
 
-    pkgs = get_nvidia_packages()
-
-    logging.info(f"Installing Nvidia packages: {pkgs}")
-
-    args = ["sudo", "dnf", "install", "-y", "--allowerasing", "--best"]
-    args.extend(pkgs)
-
-    logging.info(f"Running command: {args}")
-
-    util.execute(" ".join(args))
-
     if primary_gpu:
         logging.info("Setting Nvidia GPU as primary GPU")
         util.execute(
@@ -179,8 +155,17 @@ def setup_nvidia(primary_gpu: bool = False):
         )
 
 
+def setup_nvidia(primary_gpu: bool = False):
+    # Set up NVIDIA drivers, if applicable
+    if pkgs := nvidia_packages():
+        args = ["sudo", "dnf5", "install", "-y", "--allowerasing", "--best"]
+        args.extend(pkgs)
+
+        logging.info(f"Running command: {args}")
+
+        util.execute(" ".join(args))
 
-    
+    setup_nvidia_extras(primary_gpu)
 
 
 def nvidia_payload() -> bool:
@@ -197,42 +182,69 @@ def check_broadcom_wifi() -> bool:
     """
     Returns True if a Broadcom wifi card is installed
     """
-    # search if Network, and Broadcom are in the output of lspci
-
-    return subprocess.call("lspci | grep -q -i Network | grep -q -i Broadcom", shell=True) == 0
+    return driverdb.detected("broadcom-wl")
 
 
 def check_broadcom_bluetooth() -> bool:
     """
     Returns True if a Broadcom bluetooth card is installed
     """
-    # search if Network, and Broadcom are in the output of lspci
+    return driverdb.detected("broadcom-bt")
 
-    return subprocess.call("lspci | grep -q -i Bluetooth | grep -q -i Broadcom", shell=True) == 0
 
-
-def setup_broadcom():
+def broadcom_packages() -> list[str]:
+    """
+    Returns the Broadcom driver packages to add to the install transaction
+    """
     if not check_broadcom_wifi():
         logging.warning("No Broadcom wifi card detected, skipping Broadcom driver setup")
-        return
-    else:
-        logging.info("Broadcom wifi card detected, installing Broadcom wifi drivers")
-        util.execute("sudo dnf install -y broadcom-wl akmod-wl")
+        return []
+
+    logging.info("Broadcom wifi card detected, installing Broadcom wifi drivers")
+    db = driverdb.load()
+    pkgs = db.packages("broadcom-wl")
 
     if not check_broadcom_bluetooth():
         logging.warning("No Broadcom bluetooth card detected, skipping Broadcom driver setup")
-        return
-    
-    else:
-        logging.info("Broadcom bluetooth card detected, installing Broadcom bluetooth drivers")
-        util.execute("sudo dnf install -y broadcom-bt-firmware")
+        return pkgs
+
+    logging.info("Broadcom bluetooth card detected, installing Broadcom bluetooth drivers")
+    pkgs.extend(db.packages("broadcom-bt"))
+    return pkgs
+
+
+def detected_packages(driver_id: str) -> list[str]:
+    """
+    Returns the packages of a driver if this machine has hardware for it
+    """
+    if not driverdb.detected(driver_id):
+        logging.warning(f"No hardware for {driver_id} detected, skipping it")
+        return []
+    return driverdb.load().packages(driver_id)
+
 
+def crystalhd_packages() -> list[str]:
+    return detected_packages("crystalhd")
 
 
+def intel_ipu6_packages() -> list[str]:
+    return detected_packages("intel-ipu6")
+
+
+def v4l2loopback_packages() -> list[str]:
+    # a virtual device, there's no hardware to look for
+    return driverdb.load().packages("v4l2loopback")
+
+
+def setup_broadcom():
+    if pkgs := broadcom_packages():
+        util.execute(f"sudo dnf5 install -y {' '.join(pkgs)}")
+
 
 if __name__ == "__main__":
     if not check_internet_connection():
         logging.warning("No internet connection detected, skipping driver setup")
         exit(1)
-    setup_nvidia()
-    setup_broadcom()
\ No newline at end of file
+    with pkgcache.shared_cache():
+        setup_nvidia()
+        setup_broadcom()
\ No newline at end of file
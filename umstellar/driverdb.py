@@ -0,0 +1,154 @@
+# Driver database: which hardware wants which driver packages
+#
+# The actual data lives in driverdb.json (or wherever STELLAR_DRIVERDB points
+# to), so new devices or driver branches only need a data update. On load it
+# gets compiled into:
+# - modalias glob patterns, bucketed by bus and vendor, so a device is only
+#   checked against the handful of patterns for its own vendor
+# - sorted Nvidia PCI device ID ranges, looked up with bisect
+# - the Nvidia chipset prefix table, as a dict
+import bisect
+import fnmatch
+import functools
+import json
+import os
+import re
+
+from . import hwprobe, trace
+
+DRIVERDB = os.environ.get(
+    "STELLAR_DRIVERDB", os.path.join(os.path.dirname(__file__), "driverdb.json")
+)
+
+
+class Driver:
+    """A driver and the devices it is for."""
+
+    id: str
+    modalias: list[str]
+    packages: list[str]
+
+    def __init__(self, id: str, modalias: list[str], packages: list[str]):
+        self.id = id
+        self.modalias = modalias
+        self.packages = packages
+
+    def __repr__(self):
+        return f"Driver(id={self.id}, packages={self.packages})"
+
+
+def modalias(dev: hwprobe.Device) -> str:
+    """
+    Returns the modalias of a device, making one up from its IDs if needed
+    """
+    if dev.modalias:
+        return dev.modalias
+    if dev.bus == "pci":
+        return f"pci:v{dev.vendor:08X}d{dev.device:08X}sv*sd*bc{dev.cls >> 16:02X}sc{dev.cls >> 8 & 0xFF:02X}i{dev.cls & 0xFF:02X}"
+    return f"{dev.bus}:v{dev.vendor:04X}p{dev.device:04X}d*dc*dsc*dp*ic{dev.cls >> 16:02X}isc{dev.cls >> 8 & 0xFF:02X}ip{dev.cls & 0xFF:02X}in*"
+
+
+def _bucket(pattern: str) -> tuple[str, int | None]:
+    bus, _, rest = pattern.partition(":")
+    # pci vendors are 8 hex digits in a modalias, usb ones are 4
+    width = 8 if bus == "pci" else 4
+    vendor = rest[1 : 1 + width]
+    if rest.startswith("v") and re.fullmatch(r"[0-9A-Fa-f]+", vendor or "-"):
+        return bus, int(vendor, 16)
+    return bus, None
+
+
+class DriverDB:
+    def __init__(self, data: dict):
+        self.drivers = [Driver(**d) for d in data["drivers"]]
+        self.patterns: dict[tuple[str, int | None], list[tuple[re.Pattern, Driver]]] = {}
+        for drv in self.drivers:
+            for pat in drv.modalias:
+                self.patterns.setdefault(_bucket(pat), []).append(
+                    (re.compile(fnmatch.translate(pat), re.IGNORECASE), drv)
+                )
+        nv = data["nvidia"]
+        ranges = sorted((int(lo, 16), int(hi, 16), br) for lo, hi, br in nv["ranges"])
+        self.nvidia_starts = [lo for lo, _, _ in ranges]
+        self.nvidia_ranges = ranges
+        self.nvidia_chipsets: dict[str, str] = nv["chipsets"]
+        self.nvidia_default: str = nv["default"]
+        self.nvidia_branches: dict[str, list[str]] = nv["branches"]
+
+    def match(self, dev: hwprobe.Device) -> list[Driver]:
+        """
+        Returns the drivers for a device
+        """
+        alias = modalias(dev)
+        found = []
+        for bucket in ((dev.bus, dev.vendor), (dev.bus, None)):
+            for pat, drv in self.patterns.get(bucket, []):
+                if drv not in found and pat.match(alias):
+                    found.append(drv)
+        return found
+
+    def detect(self, table: hwprobe.DeviceTable) -> list[Driver]:
+        """
+        Returns the drivers for all devices in the table
+        """
+        found = []
+        for dev in table.devices:
+            found.extend(drv for drv in self.match(dev) if drv not in found)
+        return found
+
+    def packages(self, driver_id: str) -> list[str]:
+        """
+        Returns a copy of the packages of a driver
+        """
+        return next(drv for drv in self.drivers if drv.id == driver_id).packages.copy()
+
+    def chipset_branch(self, chipset: str) -> str:
+        """
+        Returns the last driver branch supporting an Nvidia chipset, by name
+        """
+        # the table has prefixes, so check the longest one first
+        for i in range(len(chipset), 0, -1):
+            if branch := self.nvidia_chipsets.get(chipset[:i]):
+                return branch
+        return self.nvidia_default
+
+    def device_branch(self, device: int) -> str | None:
+        """
+        Returns the last driver branch supporting an Nvidia PCI device ID, if
+        it's in the table
+        """
+        # Everything from Maxwell (0x12c0) on is one open-ended range. The
+        # gaps below it are IDs Nvidia never shipped a GPU with, those go by
+        # the chipset name instead (see driver.get_nvidia_packages)
+        i = bisect.bisect_right(self.nvidia_starts, device) - 1
+        if i >= 0 and device <= self.nvidia_ranges[i][1]:
+            return self.nvidia_ranges[i][2]
+        return None
+
+    def nvidia_packages(self, branch: str) -> list[str]:
+        return self.nvidia_branches.get(branch, [])
+
+
+@functools.cache
+def load(path: str = DRIVERDB) -> DriverDB:
+    with open(path) as f:
+        return DriverDB(json.load(f))
+
+
+@functools.cache
+@trace.traced("driverdb.detect", cat="probe")
+def detected_ids() -> frozenset[str]:
+    """
+    Returns the IDs of the drivers this machine has hardware for
+
+    The hardware doesn't change while we're running, so every check_*() after
+    the first one is just a lookup.
+    """
+    return frozenset(drv.id for drv in load().detect(hwprobe.probe()))
+
+
+def detected(driver_id: str) -> bool:
+    """
+    Returns True if there is hardware on this machine for the given driver
+    """
+    return driver_id in detected_ids()
@@ -0,0 +1,840 @@
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+from contextlib import suppress
+
+import gi
+
+gi.require_version("Gtk", "4.0")
+# libadwaita
+gi.require_version("Adw", "1")
+
+from gi.repository import Adw, Gdk, Gio, GLib, GObject, Gtk, Pango
+
+from . import apps, catalog, cli, journal, prefetch, progress, search, trace, warmup
+from .apps import category_descriptions
+
+
+CATEGORY_DESCRIPTION = "Select the components you want to also include in your system"
+
+# categories with at least this many apps get a Gtk.ListView, which only
+# builds widgets for the rows on screen, instead of one AppEntry per app
+LISTVIEW_MIN = int(os.environ.get("STELLAR_LISTVIEW_MIN", "100"))
+
+# how often the progress window redraws at most, dnf5 can print hundreds of
+# lines a second
+REDRAW_HZ = 10
+
+# the fd the installer writes its progress events to
+PROGRESS_FD = 3
+
+# what the progress window says for each dnf5 phase
+DNF5_PHASES = {
+    "download": "Downloading packages",
+    "verify": "Verifying packages",
+    "prepare": "Preparing the transaction",
+    "install": "Installing packages",
+    "scriptlets": "Running package scriptlets",
+}
+
+
+app_list: dict[str, apps.App] = {}
+# exit code of the install, None if nothing was installed
+install_rc: int | None = None
+
+
+class AppEntry(Adw.ExpanderRow):
+    def __init__(self, app: apps.App, id: str):
+        super().__init__(enable_expansion=False)
+        self.app = app
+        self.appid = id
+        self.set_title(app.name)
+        self.set_subtitle(app.description)
+        self.set_activatable(False)
+        self.connect("activate", self.on_activate)
+
+        # add tickbox to the right
+        self.tickbox = Gtk.CheckButton()
+        self.tickbox.connect("toggled", self.on_tickbox_toggled)
+
+        # add as suffix
+        self.add_prefix(self.tickbox)
+
+        if not app.option:
+            # hide enable expansion button if there's no option
+            self.set_show_enable_switch(False)
+
+        if app.option:
+            # Prefix, for the feature flags
+            # set sensitive to whatever the tickbox status is by connecting it
+            act = app.option.option
+            self.option_toggle = Gtk.CheckButton(
+                # sensitive=act, active=act,
+                margin_start=10,
+                margin_end=10,
+                margin_bottom=5,
+                margin_top=5,
+            )
+
+            # add option toggle as suffix
+            self.optionbox = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+            self.desc_label = Gtk.Label(
+                css_classes=["h4"], label=app.option.description
+            )
+            self.optionbox.append(self.option_toggle)
+            self.optionbox.append(self.desc_label)
+            self.add_row(self.optionbox)
+
+    def on_activate(self, _):
+        logging.debug(f"Activating {self.app.name}")
+
+    def on_tickbox_toggled(self, tickbox):
+        if self.app.option:
+            self.set_enable_expansion(self.tickbox.get_active())
+
+
+class AppItem(GObject.Object):
+    """An app in a Gio.ListStore."""
+
+    def __init__(self, id: str, app: apps.App):
+        super().__init__()
+        self.appid = id
+        self.app = app
+
+
+def app_store(entries: dict[str, apps.App]) -> Gio.ListStore:
+    store = Gio.ListStore(item_type=AppItem)
+    store.splice(0, 0, [AppItem(id, app) for id, app in entries.items()])
+    return store
+
+
+class AppRow(Gtk.Box):
+    """
+    Row widget for the Gtk.ListView pages
+
+    Rows get recycled as the list scrolls, so everything about the app is set
+    in bind(), and the selection itself always lives in app_list. It has the
+    same attributes as an AppEntry, so the MainWindow handlers work on both.
+    """
+
+    def __init__(self):
+        super().__init__(
+            orientation=Gtk.Orientation.VERTICAL,
+            margin_top=8,
+            margin_bottom=8,
+            margin_start=12,
+            margin_end=12,
+        )
+        self.item: AppItem | None = None
+        top = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=12)
+        self.tickbox = Gtk.CheckButton(valign=Gtk.Align.CENTER)
+        labels = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, hexpand=True)
+        self.title = Gtk.Label(xalign=0, css_classes=["heading"])
+        self.subtitle = Gtk.Label(xalign=0, wrap=True, css_classes=["dim-label"])
+        labels.append(self.title)
+        labels.append(self.subtitle)
+        top.append(self.tickbox)
+        top.append(labels)
+        self.append(top)
+
+        self.option_toggle = Gtk.CheckButton(
+            margin_start=10, margin_end=10, margin_bottom=5, margin_top=5
+        )
+        self.desc_label = Gtk.Label(css_classes=["h4"])
+        self.optionbox = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, visible=False)
+        self.optionbox.append(self.option_toggle)
+        self.optionbox.append(self.desc_label)
+        self.append(self.optionbox)
+
+        # runs after the MainWindow handler, which doesn't know whether the
+        # app this row is showing right now has an option
+        self.tickbox.connect_after("toggled", lambda _: self.sync_option())
+        self.handlers: list[tuple[GObject.Object, int]] = []
+
+    @property
+    def appid(self) -> str | None:
+        return self.item.appid if self.item else None
+
+    @property
+    def app(self) -> apps.App | None:
+        return self.item.app if self.item else None
+
+    def bind(self, item: AppItem):
+        self.item = item
+        self.title.set_label(item.app.name)
+        self.subtitle.set_label(item.app.description)
+        # don't let restoring the state look like a click
+        for obj, handler in self.handlers:
+            obj.handler_block(handler)
+        self.tickbox.set_active(item.appid in app_list)
+        if item.app.option:
+            self.desc_label.set_label(item.app.option.description)
+            self.option_toggle.set_active(item.app.option.option)
+        for obj, handler in self.handlers:
+            obj.handler_unblock(handler)
+        self.sync_option()
+
+    def unbind(self):
+        self.item = None
+
+    def sync_option(self):
+        self.optionbox.set_visible(
+            bool(self.app and self.app.option) and self.tickbox.get_active()
+        )
+
+
+class MainWindow(Gtk.ApplicationWindow):
+    @trace.traced("MainWindow", cat="gui")
+    def __init__(self, *args, **kwargs):
+        # for benchmarks and testing, use this catalog instead of the real one
+        self.catalog = kwargs.pop("catalog", None) or catalog.load()
+        kwargs["resizable"] = False
+        kwargs["title"] = "Set up your system"
+        super().__init__(*args, **kwargs)
+        self.set_default_size(800, 600)
+        # Things will go here
+        self.header_bar = Adw.HeaderBar()
+        logging.debug(self.header_bar.get_decoration_layout())
+        # do not show window controls
+        self.header_bar.set_title_widget(Adw.WindowTitle(title="Install More Apps"))
+        self.header_bar.set_show_end_title_buttons(False)
+        # don't add controls to headerbar
+        # self.header_bar.set_show_close_button(False)
+        self.install_button = Gtk.Button(
+            label="Install Selections",
+            css_classes=["suggested-action"],
+            sensitive=False,
+        )
+        self.install_button.connect("clicked", self.install)
+
+        skip_button = Gtk.Button(label="Skip")
+        # skip_button.add_css_class("destructive-action")
+
+        skip_button.connect("clicked", self.skip)
+
+        self.header_bar.pack_start(skip_button)
+        # add button to headerbar (on the end)
+        self.header_bar.pack_end(self.install_button)
+
+        self.search_entry = Gtk.SearchEntry(placeholder_text="Search apps")
+        self.search_entry.connect("search-changed", self.on_search_changed)
+        self.header_bar.pack_end(self.search_entry)
+
+        self.set_titlebar(self.header_bar)
+
+        self.scrolled = Gtk.ScrolledWindow()
+        self.scrolled.set_size_request(800, 200)
+        # force max box size to be 800x600
+
+        # self.sidebar = Gtk.StackSidebar()
+        # self.sidebar.get_stack()
+
+        self.sidebar = Gtk.ListBox(selection_mode=Gtk.SelectionMode.SINGLE)
+        for cat in self.catalog.categories():
+            logging.info(f"Found category {cat}")
+            row = Gtk.ListBoxRow(name=cat)
+            # set icon for the row too
+
+            row_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+
+            # Get icon name from apps.py:category_icons dict
+            # if not found, use "applications-other"
+            icon_name = apps.category_icons.get(cat, "applications-other")
+            icon = Gtk.Image.new_from_icon_name(icon_name)
+
+            row_box.append(icon)
+
+            title_label = Gtk.Label(
+                label=cat.title(),
+                margin_top=10,
+                margin_bottom=10,
+                margin_start=25,
+                margin_end=25,
+            )
+
+            row_box.append(title_label)
+
+            row.set_child(row_box)
+            # make row text align to the left
+            row.get_child().set_halign(Gtk.Align.START)
+            self.sidebar.append(row)
+        self.sidebar.connect("row-selected", self.on_sidebar_click)
+        self.sidebar.add_css_class("navigation-sidebar")
+
+        # left = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        # left.set_size_request(200, -1)
+        # left.append(self.sidebar)
+
+        self.box = Gtk.Box(
+            orientation=Gtk.Orientation.VERTICAL, vexpand=False, hexpand=True
+        )
+
+        # force size of box1 to be 800x600
+
+        self.box.set_margin_start(25)
+        self.box.set_margin_end(25)
+        self.box.set_margin_top(25)
+        self.box.set_margin_bottom(25)
+
+        # split into 2 boxes
+
+        header_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, margin_bottom=25)
+
+        css_provider = Gtk.CssProvider()
+        css_provider.load_from_string(".text-center { text-align: center; }")
+        Gtk.StyleContext.add_provider_for_display(
+            Gdk.Display.get_default(),
+            css_provider,
+            Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION,
+        )
+
+        # FIXME: how can I center align this
+        self.cta_label = Gtk.Label(css_classes=["h4", "text-center"])
+        self.cta_label.set_xalign(0.5)
+        self.cta_label.set_markup(CATEGORY_DESCRIPTION)
+
+        header_box.append(self.cta_label)
+
+        self.box.append(header_box)
+
+        content_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+
+        # One page per category. Each one is built once, the first time it's
+        # needed, and switching categories just flips the stack to it, so rows
+        # keep their own tickbox state.
+        self.pages = Gtk.Stack(
+            transition_type=Gtk.StackTransitionType.NONE,
+            vhomogeneous=False,
+        )
+        self.listboxes: dict[str, Gtk.Widget] = {}
+        # every row currently showing an app, by app ID, so ticking it in one
+        # page (or in the search results) ticks it everywhere
+        self.rows: dict[str, list[AppEntry | AppRow]] = {}
+        self.current = ""
+        # search results page, built on the first search
+        self.query = ""
+        self.results: Gio.ListStore | None = None
+        self.items: dict[str, AppItem] = {}
+
+        default_cat = self.sidebar.get_first_child()
+        if default_cat:
+            default_cat = default_cat.get_name()
+        else:
+            default_cat = "Utilities"
+
+        self.show_page(default_cat)
+        # build the rest while the user is looking at the first one
+        self._unbuilt = [c for c in self.catalog.categories() if c != default_cat]
+        GLib.idle_add(self.build_next_page, priority=GLib.PRIORITY_LOW)
+
+        content_box.append(self.pages)
+
+        self.box.append(content_box)
+
+        # note: this is the main view
+
+        # self.big_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        self.big_box = Adw.NavigationSplitView()
+        self.big_box.set_size_request(800, 600)
+        # set size limit to 800x600
+
+        self.set_child(self.big_box)
+        # todo: port to Adw.NavigationSplitView
+        sidebar_page = Adw.NavigationPage()
+        sidebar_page.set_child(self.sidebar)
+        self.big_box.set_sidebar(sidebar_page)
+
+        self.list_page = Adw.NavigationPage()
+        self.scrolled.set_child(self.box)
+        self.list_page.set_child(self.scrolled)
+        self.big_box.set_content(self.list_page)
+
+        # self.scrolled.set_child(self.big_box)
+
+    def on_sidebar_click(self, _: Gtk.ListBox, row: Gtk.ListBoxRow):
+        logging.debug("Sidebar moment")
+        cat = row.get_name()
+
+        if desc := category_descriptions.get(cat, None):
+            self.cta_label.set_markup(CATEGORY_DESCRIPTION + "\n" + desc)
+        else:
+            self.cta_label.set_markup(CATEGORY_DESCRIPTION)
+
+        if self.query:
+            # picking a category ends the search
+            self.query = ""
+            self.search_entry.set_text("")
+        self.show_page(cat)
+
+    def build_page(self, cat: str) -> Gtk.Widget:
+        entries = self.catalog.category(cat)
+        with trace.span(f"page {cat}", cat="gui", apps=len(entries)):
+            return self._build_page(cat, entries)
+
+    def _build_page(self, cat: str, entries: dict[str, apps.App]) -> Gtk.Widget:
+        if len(entries) >= LISTVIEW_MIN:
+            page = self.build_list(app_store(entries))
+            self.listboxes[cat] = page
+            self.pages.add_named(page, cat)
+            return page
+
+        listbox = Gtk.ListBox(
+            selection_mode=Gtk.SelectionMode.NONE, css_classes=["boxed-list"]
+        )
+
+        for id, app in entries.items():
+            row = AppEntry(app, id)
+            self.rows.setdefault(id, []).append(row)
+
+            # connect row's suffix's tickbox to an action
+            # where it adds the app to the list of apps to install
+            row.tickbox.connect("toggled", self.on_app_toggled(row))
+
+            # some doesn't have option_toggle
+            with suppress(AttributeError):
+                row.option_toggle.connect("toggled", self.on_rowoption_toggled(row))
+
+            listbox.append(row)
+
+        self.listboxes[cat] = listbox
+        self.pages.add_named(listbox, cat)
+        return listbox
+
+    def build_list(self, model: Gio.ListModel) -> Gtk.Widget:
+        """
+        Returns a Gtk.ListView page showing the apps in the model
+        """
+        factory = Gtk.SignalListItemFactory()
+        factory.connect("setup", self.on_row_setup)
+        factory.connect("bind", self.on_row_bind)
+        factory.connect("unbind", self.on_row_unbind)
+        view = Gtk.ListView(
+            model=Gtk.NoSelection(model=model),
+            factory=factory,
+            css_classes=["rich-list"],
+        )
+        # the list has to be the direct child of a scrolled window to only
+        # build the visible rows, so it scrolls on its own inside the page
+        return Gtk.ScrolledWindow(
+            child=view,
+            vexpand=True,
+            min_content_height=400,
+            css_classes=["card"],
+        )
+
+    def on_row_setup(self, _: Gtk.SignalListItemFactory, item: Gtk.ListItem):
+        row = AppRow()
+        row.handlers = [
+            (row.tickbox, row.tickbox.connect("toggled", self.on_app_toggled(row))),
+            (
+                row.option_toggle,
+                row.option_toggle.connect("toggled", self.on_rowoption_toggled(row)),
+            ),
+        ]
+        item.set_child(row)
+        item.set_activatable(False)
+
+    def on_row_bind(self, _: Gtk.SignalListItemFactory, item: Gtk.ListItem):
+        row = item.get_child()
+        row.bind(item.get_item())
+        self.rows.setdefault(row.appid, []).append(row)
+
+    def on_row_unbind(self, _: Gtk.SignalListItemFactory, item: Gtk.ListItem):
+        row = item.get_child()
+        with suppress(KeyError, ValueError):
+            self.rows[row.appid].remove(row)
+        row.unbind()
+
+    def on_search_changed(self, entry: Gtk.SearchEntry):
+        query = entry.get_text().strip()
+        if not query:
+            self.query = ""
+            self.show_page(self.current)
+            return
+        if self.results is None:
+            self.results = Gio.ListStore(item_type=AppItem)
+            self.pages.add_named(self.build_list(self.results), "search")
+        self.query = query
+        # the index already has the matches, best first, so the page shows
+        # exactly those instead of filtering the whole catalog for them
+        ids = [id for id in search.index().search(query) if id in self.catalog.apps]
+        for id in ids:
+            if id not in self.items:
+                self.items[id] = AppItem(id, self.catalog.apps[id])
+        self.results.splice(
+            0, self.results.get_n_items(), [self.items[id] for id in ids]
+        )
+        self.pages.set_visible_child_name("search")
+
+    def build_next_page(self) -> bool:
+        while self._unbuilt:
+            if (cat := self._unbuilt.pop(0)) not in self.listboxes:
+                self.build_page(cat)
+                return GLib.SOURCE_CONTINUE
+        return GLib.SOURCE_REMOVE
+
+    def show_page(self, cat: str):
+        self.current = cat
+        if cat not in self.listboxes:
+            self.build_page(cat)
+        self.pages.set_visible_child_name(cat)
+
+    def on_app_toggled(self, appentry: AppEntry):
+        def inner(checkbtn):
+            logging.debug("toggled")
+
+            if checkbtn.get_active():
+                # set key of id in app_list to app
+                app_list.update({appentry.appid: appentry.app})
+                # start downloading it while the user keeps picking
+                prefetch.enqueue(appentry.appid, appentry.app)
+                with suppress(AttributeError):
+                    appentry.desc_label.set_visible(True)
+                    appentry.optionbox.set_visible(True)
+                    appentry.option_toggle.set_visible(True)
+            else:
+                # remove key from app_list
+                app_list.pop(appentry.appid, None)
+                prefetch.cancel(appentry.appid)
+                with suppress(AttributeError):
+                    appentry.optionbox.set_visible(False)
+
+            for other in self.rows.get(appentry.appid, []):
+                if other is not appentry:
+                    other.tickbox.set_active(checkbtn.get_active())
+
+            logging.debug(app_list)
+            self.install_button.set_sensitive(bool(app_list))
+
+        return inner
+
+    def close_window(self):
+        self.close()
+        return
+
+    def install(self, _):
+        logging.debug(app_list)
+        ProgressWindow(application=self.get_application(), selected=dict(app_list)).present()
+        self.close_window()
+        self.destroy()
+
+    def offer_resume(self, unfinished: journal.Pending):
+        """
+        Asks whether to finish the install that was cut short, or forget it
+        and pick the apps again
+        """
+        dialog = Adw.MessageDialog(
+            transient_for=self,
+            heading="Finish the last install?",
+            body=(
+                f"Installing {', '.join(unfinished.apps)} didn't finish "
+                f"(attempt {unfinished.attempts} of {journal.MAX_ATTEMPTS}). "
+                "Try it again, skipping what's already done, or start over "
+                "and pick the apps again."
+            ),
+        )
+        dialog.add_response("start-over", "Start Over")
+        dialog.add_response("resume", "Resume")
+        dialog.set_response_appearance("resume", Adw.ResponseAppearance.SUGGESTED)
+        dialog.set_default_response("resume")
+        dialog.set_close_response("start-over")
+
+        def on_response(_, response: str):
+            if response == "resume":
+                self.resume(unfinished)
+            else:
+                logging.info("Starting over, dropping the unfinished install")
+                journal.discard()
+
+        dialog.connect("response", on_response)
+        dialog.present()
+
+    def resume(self, unfinished: journal.Pending):
+        try:
+            selected = cli.select(self.catalog, unfinished.apps, unfinished.options)
+        except KeyError as e:
+            # stay here and let the user pick again
+            logging.warning(f"Cannot resume the last install, unknown apps: {e}")
+            journal.discard()
+            return
+        logging.info(f"Resuming the install of {', '.join(selected)}")
+        ProgressWindow(application=self.get_application(), selected=selected).present()
+        self.close_window()
+        self.destroy()
+
+    def skip(self, _):
+        # exit
+        logging.debug("exiting")
+        prefetch.stop(wait=False)
+        warmup.cancel()
+        exit(0)
+
+    def on_rowoption_toggled(self, parent):
+        def inner(checkbtn):
+            act = checkbtn.get_active()
+
+            if opt := app_list.get(parent.appid, None).option:
+                opt.set(act)
+                if parent.appid in app_list:
+                    opt.set(act)
+
+            logging.debug(app_list)
+
+        return inner
+
+
+class ProgressWindow(Gtk.ApplicationWindow):
+    """
+    Shows how the install is going
+
+    The install runs as `umstellar install --progress-fd N` in a child
+    process, and its events come in through a pipe watched by the main loop.
+    Events only update a progress.State, the widgets get redrawn from it at
+    most REDRAW_HZ times a second. The child exiting is what ends it.
+    """
+
+    def __init__(self, *args, selected: dict[str, apps.App], **kwargs):
+        kwargs["resizable"] = False
+        kwargs["deletable"] = False
+        kwargs["title"] = "Installing"
+        super().__init__(*args, **kwargs)
+        self.set_default_size(600, -1)
+        self.selected = selected
+        self.state = progress.State()
+        self.buf = b""
+        self.redraw: int | None = None
+        # the pipe the events come in on, and its watch
+        self.fd: int | None = None
+        self.watch: int | None = None
+        self.selection_path: str | None = None
+
+        header_bar = Adw.HeaderBar()
+        header_bar.set_title_widget(Adw.WindowTitle(title="Installing Apps"))
+        header_bar.set_show_end_title_buttons(False)
+        self.close_button = Gtk.Button(
+            label="Close", css_classes=["suggested-action"], sensitive=False
+        )
+        self.close_button.connect("clicked", lambda _: self.close())
+        header_bar.pack_end(self.close_button)
+        self.set_titlebar(header_bar)
+
+        box = Gtk.Box(
+            orientation=Gtk.Orientation.VERTICAL,
+            spacing=10,
+            margin_top=25,
+            margin_bottom=25,
+            margin_start=25,
+            margin_end=25,
+        )
+        self.status = Gtk.Label(
+            label="Waiting for the downloads to finish…", css_classes=["h4"], xalign=0
+        )
+        self.bar = Gtk.ProgressBar(hexpand=True, show_text=True)
+        box.append(self.status)
+        box.append(self.bar)
+        # one line per backend, dnf5 and flatpak run at the same time
+        self.backends: dict[str, tuple[Gtk.Label, Gtk.ProgressBar]] = {}
+        for backend in ("dnf5", "flatpak"):
+            label = Gtk.Label(
+                css_classes=["dim-label"],
+                xalign=0,
+                ellipsize=Pango.EllipsizeMode.END,
+                visible=False,
+            )
+            bar = Gtk.ProgressBar(hexpand=True, visible=False)
+            box.append(label)
+            box.append(bar)
+            self.backends[backend] = (label, bar)
+        self.set_child(box)
+
+        # whatever was downloading in the background gets to finish first,
+        # without blocking the main loop
+        threading.Thread(target=self.settle, name="stellar-settle", daemon=True).start()
+
+    def settle(self):
+        prefetch.stop()
+        warmup.wait()
+        GLib.idle_add(self.spawn)
+
+    def spawn(self) -> bool:
+        fd, self.selection_path = tempfile.mkstemp(
+            prefix="stellar-selection-", suffix=".toml"
+        )
+        os.close(fd)
+        cli.write_selection(self.selection_path, self.selected)
+        r, w = os.pipe()
+        # so `-m umstellar` finds this copy of it, installed or not
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = os.environ | {
+            "PYTHONPATH": os.pathsep.join(
+                filter(None, [root, os.environ.get("PYTHONPATH")])
+            )
+        }
+        if path := trace.child_path("install"):
+            env["STELLAR_TRACE"] = path
+        cmd = [
+            sys.executable,
+            "-m",
+            "umstellar",
+            "install",
+            "--selection",
+            self.selection_path,
+            "--yes",
+            "--progress-fd",
+            str(PROGRESS_FD),
+        ]
+        # Gio reaps the installer and hands back its real exit status, and
+        # only the progress pipe gets passed down, not every fd GTK has open
+        launcher = Gio.SubprocessLauncher.new(Gio.SubprocessFlags.NONE)
+        launcher.set_environ([f"{k}={v}" for k, v in env.items()])
+        launcher.take_fd(w, PROGRESS_FD)
+        try:
+            proc = launcher.spawnv(cmd)
+        except GLib.Error as e:
+            logging.error(f"Cannot start the installer: {e.message}")
+            os.close(r)
+            launcher.close()
+            self.finish(1)
+            return GLib.SOURCE_REMOVE
+        # drops our end of the pipe, so reading it sees EOF once the
+        # installer is gone
+        launcher.close()
+        os.set_blocking(r, False)
+        self.fd = r
+        self.watch = GLib.unix_fd_add_full(
+            GLib.PRIORITY_DEFAULT,
+            r,
+            GLib.IOCondition.IN | GLib.IOCondition.HUP | GLib.IOCondition.ERR,
+            self.on_events,
+        )
+        proc.wait_async(None, self.on_child_exit)
+        return GLib.SOURCE_REMOVE
+
+    def on_events(self, fd: int, _: GLib.IOCondition) -> bool:
+        if self.read(fd):
+            return GLib.SOURCE_CONTINUE
+        os.close(fd)
+        self.fd = self.watch = None
+        return GLib.SOURCE_REMOVE
+
+    def read(self, fd: int) -> bool:
+        """
+        Returns False once the installer closed its end of the pipe
+        """
+        eof = False
+        while True:
+            try:
+                chunk = os.read(fd, 65536)
+            except BlockingIOError:
+                break
+            if not chunk:
+                eof = True
+                break
+            self.buf += chunk
+        *lines, self.buf = self.buf.split(b"\n")
+        for line in lines:
+            try:
+                self.state.apply(json.loads(line))
+            except (ValueError, KeyError, TypeError):
+                logging.debug(f"Bad progress event: {line!r}")
+        if lines and self.redraw is None:
+            self.redraw = GLib.timeout_add(1000 // REDRAW_HZ, self.draw)
+        return not eof
+
+    def draw(self) -> bool:
+        self.redraw = None
+        self.bar.set_fraction(self.state.fraction())
+        running = self.state.running()
+        if "repos" in running:
+            self.status.set_label("Adding repositories…")
+        elif "dnf" in running and "dnf5" in self.state.backends:
+            self.status.set_label(
+                DNF5_PHASES.get(self.state.backends["dnf5"]["phase"], "Installing packages")
+                + "…"
+            )
+        elif "dnf" in running:
+            self.status.set_label("Resolving packages…")
+        elif "flatpak" in running:
+            self.status.set_label("Installing Flatpaks…")
+        elif running:
+            self.status.set_label("Setting up apps…")
+        for backend, (label, bar) in self.backends.items():
+            ev = self.state.backends.get(backend)
+            step = "dnf" if backend == "dnf5" else backend
+            shown = ev is not None and self.state.steps.get(step) == "running"
+            label.set_visible(shown)
+            bar.set_visible(shown)
+            if shown:
+                label.set_label(f"[{ev['done']}/{ev['total']}] {ev['item']}")
+                bar.set_fraction(
+                    ev["percent"] / 100 if "percent" in ev else ev["done"] / max(ev["total"], 1)
+                )
+        return GLib.SOURCE_REMOVE
+
+    def on_child_exit(self, proc: Gio.Subprocess, result: Gio.AsyncResult):
+        proc.wait_finish(result)
+        rc = os.waitstatus_to_exitcode(proc.get_status())
+        logging.debug(f"Installer exited with code {rc}")
+        self.finish(rc)
+
+    def finish(self, rc: int):
+        global install_rc
+        install_rc = rc
+        if self.selection_path:
+            with suppress(OSError):
+                os.unlink(self.selection_path)
+        if self.fd is not None:
+            # the exit can come in before the last events
+            self.read(self.fd)
+            GLib.source_remove(self.watch)
+            os.close(self.fd)
+            self.fd = self.watch = None
+        if self.redraw is not None:
+            GLib.source_remove(self.redraw)
+        self.draw()
+        for label, bar in self.backends.values():
+            label.set_visible(False)
+            bar.set_visible(False)
+        if rc == 0:
+            self.bar.set_fraction(1.0)
+            self.status.set_label("All done!")
+        elif failed := self.state.failed():
+            self.status.set_label(f"Install failed at {', '.join(failed)}")
+        elif skipped := self.state.skipped:
+            names = [a.name for id, a in self.selected.items() if id in skipped]
+            self.status.set_label(
+                f"Could not reach the sources of {', '.join(names)}, try again later"
+            )
+        else:
+            self.status.set_label(f"Install failed (exit code {rc})")
+        self.close_button.set_sensitive(True)
+        self.set_deletable(True)
+
+
+class App(Adw.Application):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.connect("activate", self.on_activate)
+
+    def on_activate(self, app):
+        self.win = MainWindow(application=app)
+        self.win.present()
+        # refresh the metadata while the user is picking apps
+        warmup.start()
+        # the last install was cut short, see if it should be finished
+        if unfinished := journal.pending():
+            self.win.offer_resume(unfinished)
+
+
+def main() -> int:
+    app = App()
+    app.run(sys.argv[:1])
+
+    if install_rc is None:
+        prefetch.stop(wait=False)
+        warmup.cancel()
+        return 0
+    return install_rc
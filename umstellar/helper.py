@@ -0,0 +1,109 @@
+# Privileged helper for running payload scripts
+#
+# This file is started once per run as root (through pkexec on the host, or
+# directly when we already are root, like in the Anaconda %post), and then
+# takes scripts over stdin for the rest of the run, so we only pay for the
+# polkit round-trip and the process spawn once.
+#
+# It is run by path, not as part of the package, so it must not import
+# anything from umstellar.
+#
+# Protocol: one JSON object per line.
+#   request:  {"id": 1, "script": "...", "env": {"STELLAR_OPTION": "1"}}
+#   replies:  {"id": 1, "out": "a line of output\n"} (any number of them)
+#             {"id": 1, "rc": 0}
+#   request:  {"id": 2, "write": "/etc/yum.repos.d/foo.repo", "data": "...", "mode": 420}
+#   replies:  {"id": 2, "rc": 0}
+# A {"ready": true} line is sent once the helper is set up.
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+_send_lock = threading.Lock()
+
+
+def send(msg: dict):
+    with _send_lock:
+        sys.stdout.write(json.dumps(msg) + "\n")
+        sys.stdout.flush()
+
+
+def run(req: dict):
+    """
+    Runs a single script request, streaming its output back
+    """
+    rcid = req["id"]
+    script = req["script"]
+    if not script.startswith("#!"):
+        # prepend shebang
+        script = "#!/bin/sh\n" + script
+    try:
+        fd, path = tempfile.mkstemp(prefix="stellar-payload-", suffix=".sh")
+        with os.fdopen(fd, "w") as f:
+            f.write(script)
+        os.chmod(path, 0o755)
+        try:
+            proc = subprocess.Popen(
+                [path],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                stdin=subprocess.DEVNULL,
+                env=os.environ | req.get("env", {}),
+                text=True,
+                errors="replace",
+            )
+            assert proc.stdout
+            for line in proc.stdout:
+                send({"id": rcid, "out": line})
+            rc = proc.wait()
+        finally:
+            os.remove(path)
+    except Exception as e:
+        send({"id": rcid, "out": f"stellar-helper: {e}\n"})
+        rc = 255
+    send({"id": rcid, "rc": rc})
+
+
+def write(req: dict):
+    """
+    Writes a file, replacing it in one go
+    """
+    rcid = req["id"]
+    path = req["write"]
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.stellar-tmp"
+        with open(tmp, "w") as f:
+            f.write(req["data"])
+        os.chmod(tmp, req.get("mode", 0o644))
+        os.replace(tmp, path)
+        rc = 0
+    except OSError as e:
+        send({"id": rcid, "out": f"stellar-helper: {e}\n"})
+        rc = 1
+    send({"id": rcid, "rc": rc})
+
+
+def main():
+    if "--root" in sys.argv:
+        # everything we'll need is imported by now, so it's safe to move
+        # into the target system for good
+        os.chroot(sys.argv[sys.argv.index("--root") + 1])
+        os.chdir("/")
+    send({"ready": True})
+    threads = []
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        req = json.loads(line)
+        th = threading.Thread(target=write if "write" in req else run, args=[req])
+        th.start()
+        threads.append(th)
+    [th.join() for th in threads]
+
+
+if __name__ == "__main__":
+    main()
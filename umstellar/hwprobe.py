@@ -0,0 +1,236 @@
+# Hardware probing, straight from sysfs
+#
+# Instead of running lspci for every question, we walk /sys/bus/pci and
+# /sys/bus/usb once, and keep the result around: in memory for the rest of
+# the process, and on disk keyed by a hash of the device topology, so the
+# next run on the same machine doesn't even need to read the device files.
+import functools
+import hashlib
+import json
+import logging
+import os
+
+from . import trace
+
+SYSFS = os.environ.get("STELLAR_SYSFS", "/sys")
+CACHE = "/var/cache/stellar/hwprobe.json"
+PCI_IDS = ["/usr/share/hwdata/pci.ids", "/usr/share/misc/pci.ids"]
+
+# PCI vendor IDs
+NVIDIA = 0x10DE
+
+# PCI base classes
+DISPLAY = 0x03
+
+
+class Device:
+    """A PCI device or USB interface."""
+
+    bus: str
+    slot: str
+    vendor: int
+    device: int
+    cls: int
+    modalias: str
+
+    def __init__(
+        self, bus: str, slot: str, vendor: int, device: int, cls: int, modalias: str
+    ):
+        self.bus = bus
+        self.slot = slot
+        self.vendor = vendor
+        self.device = device
+        # 24-bit class code: base class, subclass, programming interface
+        self.cls = cls
+        self.modalias = modalias
+
+    def __repr__(self):
+        return f"Device(bus={self.bus}, slot={self.slot}, id={self.vendor:04x}:{self.device:04x}, class={self.cls:06x})"
+
+    def to_dict(self):
+        return {
+            "bus": self.bus,
+            "slot": self.slot,
+            "vendor": self.vendor,
+            "device": self.device,
+            "cls": self.cls,
+            "modalias": self.modalias,
+        }
+
+
+class DeviceTable:
+    """All probed devices, indexed by vendor, class and ID."""
+
+    def __init__(self, devices: list[Device]):
+        self.devices = devices
+        self.by_vendor: dict[tuple[str, int], list[Device]] = {}
+        self.by_class: dict[tuple[str, int], list[Device]] = {}
+        self.by_id: dict[tuple[str, int, int], list[Device]] = {}
+        for dev in devices:
+            self.by_vendor.setdefault((dev.bus, dev.vendor), []).append(dev)
+            self.by_class.setdefault((dev.bus, dev.cls >> 16), []).append(dev)
+            self.by_id.setdefault((dev.bus, dev.vendor, dev.device), []).append(dev)
+
+    def find(
+        self,
+        bus: str = "pci",
+        vendor: int | None = None,
+        base_class: int | None = None,
+        cls: int | None = None,
+        mask: int = 0xFFFFFF,
+    ) -> list[Device]:
+        """
+        Returns the devices on `bus` matching everything that was given
+
+        `cls` is compared against the class code after applying `mask`.
+        """
+        if vendor is not None:
+            devs = self.by_vendor.get((bus, vendor), [])
+        elif base_class is not None:
+            devs = self.by_class.get((bus, base_class), [])
+        else:
+            devs = [dev for dev in self.devices if dev.bus == bus]
+        if base_class is not None:
+            devs = [dev for dev in devs if dev.cls >> 16 == base_class]
+        if cls is not None:
+            devs = [dev for dev in devs if dev.cls & mask == cls]
+        return devs
+
+    def to_dict(self):
+        return {"devices": [dev.to_dict() for dev in self.devices]}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "DeviceTable":
+        return cls([Device(**dev) for dev in data["devices"]])
+
+
+def _read(path: str) -> str:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def _hex(s: str) -> int:
+    try:
+        return int(s, 16)
+    except ValueError:
+        return 0
+
+
+def scan_pci(root: str = SYSFS) -> list[Device]:
+    base = os.path.join(root, "bus", "pci", "devices")
+    devs = []
+    for slot in sorted(os.listdir(base) if os.path.isdir(base) else []):
+        path = os.path.join(base, slot)
+        devs.append(
+            Device(
+                "pci",
+                slot,
+                _hex(_read(os.path.join(path, "vendor"))),
+                _hex(_read(os.path.join(path, "device"))),
+                _hex(_read(os.path.join(path, "class"))),
+                _read(os.path.join(path, "modalias")),
+            )
+        )
+    return devs
+
+
+def scan_usb(root: str = SYSFS) -> list[Device]:
+    """
+    Returns every USB interface, with the IDs of the device it belongs to
+    """
+    base = os.path.join(root, "bus", "usb", "devices")
+    devs = []
+    for name in sorted(os.listdir(base) if os.path.isdir(base) else []):
+        # interfaces look like 1-1.2:1.0, their device is 1-1.2
+        if ":" not in name:
+            continue
+        path = os.path.join(base, name)
+        parent = os.path.join(base, name.split(":")[0])
+        devs.append(
+            Device(
+                "usb",
+                name,
+                _hex(_read(os.path.join(parent, "idVendor"))),
+                _hex(_read(os.path.join(parent, "idProduct"))),
+                _hex(_read(os.path.join(path, "bInterfaceClass"))) << 16
+                | _hex(_read(os.path.join(path, "bInterfaceSubClass"))) << 8
+                | _hex(_read(os.path.join(path, "bInterfaceProtocol"))),
+                _read(os.path.join(path, "modalias")),
+            )
+        )
+    return devs
+
+
+def topology_hash(root: str = SYSFS) -> str:
+    """
+    Returns a hash of which PCI and USB devices are where
+
+    Each device's modalias goes in with its slot, so swapping a card for
+    another one in the same slot changes it too. That's one small read per
+    device, still cheap enough to check on every run.
+    """
+    h = hashlib.sha256(os.path.abspath(root).encode())
+    for bus in ("pci", "usb"):
+        base = os.path.join(root, "bus", bus, "devices")
+        for name in sorted(os.listdir(base) if os.path.isdir(base) else []):
+            modalias = _read(os.path.join(base, name, "modalias"))
+            h.update(f"{bus}:{name}:{modalias}\n".encode())
+    return h.hexdigest()
+
+
+@functools.cache
+@trace.traced("hwprobe", cat="probe")
+def probe(root: str = SYSFS, cache: str | None = CACHE) -> DeviceTable:
+    """
+    Returns the device table of the machine, scanning sysfs only if needed
+    """
+    key = topology_hash(root)
+    if cache:
+        try:
+            with open(cache) as f:
+                data = json.load(f)
+            if data["key"] == key:
+                return DeviceTable.from_dict(data)
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+    table = DeviceTable(scan_pci(root) + scan_usb(root))
+    logging.debug(f"Probed {len(table.devices)} devices from {root}")
+    if cache:
+        try:
+            os.makedirs(os.path.dirname(cache), exist_ok=True)
+            with open(cache, "w") as f:
+                json.dump({"key": key} | table.to_dict(), f)
+        except OSError as e:
+            logging.debug(f"Cannot write hardware cache {cache}: {e}")
+    return table
+
+
+@functools.cache
+def pci_device_names(vendor: int) -> dict[int, str]:
+    """
+    Returns the pci.ids device names of a vendor, like lspci shows them
+    """
+    names = {}
+    for path in PCI_IDS:
+        try:
+            f = open(path, encoding="utf-8", errors="replace")
+        except OSError:
+            continue
+        with f:
+            found = False
+            for line in f:
+                if not found:
+                    found = line.startswith(f"{vendor:04x} ")
+                    continue
+                if line.startswith("\t\t") or line.startswith("#"):
+                    continue
+                if not line.startswith("\t"):
+                    # next vendor
+                    break
+                did, _, name = line.strip().partition(" ")
+                names[_hex(did)] = name.strip()
+        return names
+    return names
@@ -4,253 +4,356 @@
 # Don't blame me for the abusive use of global variables, poor logics and lack of error handling.
 # I have no idea why everyone else in my team is a deadline fighter and no one has the intention
 # to even attempt to meet deadlines.
+import codecs
 import logging
-import multiprocessing as mp
 import os
+import selectors
+import shlex
 import sys
-import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import suppress
-from multiprocessing import Process, Queue
 from subprocess import PIPE, Popen
-from threading import Thread
 from types import NoneType
-from typing import IO, Callable, Iterable
-
-from gi.repository import GLib, Gtk
-
-# from . import App, Dnf, DnfRm, Flatpak, Payload, Procedure
-from __init__ import App, Dnf, DnfRm, Flatpak, Payload, Procedure
-
-# job = mp.Value("i", 0)
-# total_jobs = 0
-# state = mp.Value("i", 0)
-# PROC = 1
-# SCRIPT = 2
-# DNFRM = 3
-# DNFIN = 4
-# DNFDL = 6
-# FLATPAK = 5
-# before_dnf = 0
-# dnf_total = 0
-
-
-# class InstallProgressApp(Gtk.Application):
-#     def do_activate(self):
-#         self.window = InstallProgressWindow()
-
-
-# class InstallProgressWindow(Gtk.Window):
-#     lbl = Gtk.Label(label="Test Label")
-#     progress = Gtk.ProgressBar(hexpand=True)
-#
-#     def __init__(self, *args, **kwargs):
-#         super().__init__(*args, **kwargs)
-#         self.set_default_size(800, 600)
-#         # self.header_bar = Adw.HeaderBar()
-#         # self.header_bar.set_show_end_title_buttons(False)
-#         self.box = Gtk.Box(
-#             orientation=Gtk.Orientation.VERTICAL,
-#             vexpand=False,
-#             hexpand=True,
-#             margin_top=25,
-#             margin_end=25,
-#             margin_start=25,
-#             margin_bottom=25,
-#         )
-#         self.box.append(self.lbl)
-#         self.box.append(self.progress)
-#         self.set_child(self.box)
-#         self.th = Thread(target=self.th_update_progress)
-#         self.th.daemon = True
-#         self.th.start()
-#         self.present()
-#
-#     def th_update_progress(self):
-#         while job.value != total_jobs:
-#             GLib.idle_add(self.update_progress, job.value)
-#             time.sleep(0.1)
-#
-#     def update_progress(self, value: float):
-#         self.progress.set_fraction(value)
-#         self.lbl.set_text(self.determine_state())
-#         return False
-#
-#     def determine_state(self) -> str:
-#         global state, job, total_jobs, PROC, SCRIPT, DNFRM, DNFIN, DNFDL, FLATPAK
-#         match state.value:
-#             case 1:
-#                 return f"[{job.value}/{total_jobs}] Running function"
-#             case 2:
-#                 return f"[{job.value}/{total_jobs}] Running script"
-#             case 3:
-#                 return f"[{job.value}/{total_jobs}] Removing packages"
-#             case 4:
-#                 return f"[{job.value}/{total_jobs}] Installing RPM packages"
-#             case 6:
-#                 return f"[{job.value}/{total_jobs}] Downloading RPM packages"
-#             case 5:
-#                 return f"[{job.value}/{total_jobs}] Installing Flatpak packages"
-#             case _:
-#                 logging.warn(f"Unknown state.value: {state.value}")
-#                 return f"[{job.value}/{total_jobs}] Loading…"
-
-
-def gather[T: Payload](cls: type[T], apps: dict[str, App]) -> list[T]:
-    return [
-        payload
-        for app in apps.values()
-        for payload in app.payloads
-        if isinstance(payload, cls)
-    ]
+from typing import Callable, Iterable
+
+from . import (
+    App,
+    PayloadError,
+    Repo,
+    capture,
+    journal,
+    netprobe,
+    pkgcache,
+    plan,
+    prefetch,
+    progress,
+    scheduler,
+    trace,
+    util,
+    warmup,
+)
 
 
 def process_installs(apps: dict[str, App]):
-    global total_jobs
-    total_jobs = len(apps) + len(gather(Dnf, apps))
-    install(apps)
-    # p = mp.Process(target=install, args=[apps])
-    # p.start()
-    # gui = InstallProgressApp()
-    # gui.run(sys.argv)
-    # print("Joining install proc")
-    # while p.is_alive():
-    #     time.sleep(0.01)
-    # p.join()
-    # print("Joining GUI")
-    # gui.window.th.join()
-
-
-def install(apps: dict[str, App]):
-    # global job, state
-    dnfrms = gather(DnfRm, apps)
-    dnfs = gather(Dnf, apps)
-    flatpaks = gather(Flatpak, apps)
-    run_special_payloads(apps, lambda payload: payload.priority < 0)
+    with trace.span("install", cat="install", apps=list(apps)):
+        ok, skipped = reachable_apps(apps)
+        if skipped:
+            progress.emit({"event": "skipped", "apps": list(skipped)})
+        p = plan.build(ok)
+        # the journal has the whole selection, so the skipped apps get
+        # another try when it's resumed
+        install(p, log=journal.Journal.begin(apps, p), commit=not skipped)
+    if skipped:
+        raise PayloadError(
+            "Not installed, their sources are not reachable: "
+            + ", ".join(app.name for app in skipped.values())
+        )
+
+
+def install(
+    p: plan.Plan,
+    pipeline: bool = True,
+    log: journal.Journal | None = None,
+    commit: bool = True,
+):
+    """
+    Runs a plan, skipping the steps the journal has as done, and raises
+    PayloadError if anything failed
+
+    Without commit, the journal is left unfinished even if everything in the
+    plan went fine.
+    """
+    log = log or journal.Journal()
+    try:
+        run_plan(p, pipeline, log)
+        if commit:
+            log.commit()
+    finally:
+        # without a commit the journal stays unfinished, so the next run
+        # picks it up
+        log.close()
+
+
+def run_plan(p: plan.Plan, pipeline: bool, log: journal.Journal):
+    """
+    Runs the steps of a plan the journal doesn't have as done yet
+    """
+    # what an interrupted run already did
+    dnf = p.step("dnf")
+    dnf = dnf if dnf and not log.finished(dnf) else None
+    flatpak = p.step("flatpak")
+    flatpak = flatpak if flatpak and not log.finished(flatpak) else None
+    progress.emit(
+        {"event": "plan", "steps": [{"id": s.id, "stage": s.stage} for s in p.steps]}
+    )
+    for step in p.steps:
+        if log.finished(step):
+            progress.step(step.id, "done")
+    # the metadata refreshed and the packages downloaded while the user was
+    # picking apps are what the install is going to use, so let the download
+    # that's running finish instead of racing it (and skip the rest)
+    prefetch.stop()
+    warmup.wait()
+    if not util.authorize():
+        raise PayloadError("Cannot get root privileges through sudo")
+    with (
+        pkgcache.shared_cache(),
+        ThreadPoolExecutor(thread_name_prefix="stellar-install") as pool,
+    ):
+        # Packages from the repos that are already configured can be fetched
+        # while the repo setup scripts are still running; the real transaction
+        # later picks them up from the dnf cache instead of downloading again.
+        early = None
+        if pipeline and dnf and dnf.prefetch:
+            early = pool.submit(
+                run_dnf, "in", ["--downloadonly", *dnf.prefetch], prefix="prefetch ┃ "
+            )
+        scheduler.run(log.todo(p.stage("pre")), on_done=log.complete)
+        if (repos := p.step("repos")) and not log.finished(repos):
+            progress.step(repos.id, "running")
+            try:
+                with trace.span(repos.id, cat="repos", repos=[r.id for r in repos.repos]):
+                    run_repos(repos.repos)
+            except PayloadError:
+                progress.step(repos.id, "failed")
+                raise
+            progress.step(repos.id, "done")
+            log.complete(repos)
+        if early:
+            # not fatal, the transaction will just download what's missing
+            with suppress(Exception):
+                if rc := early.result():
+                    logging.warning(f"dnf5 prefetch exited with code {rc}")
+        # The rpmdb and the flatpak installation don't share anything, so both
+        # backends run at the same time. Each one gets its own output prefix,
+        # and one failing doesn't stop the other.
+        jobs: dict[plan.Step, Future[int]] = {}
+        if dnf:
+            progress.step(dnf.id, "running")
+            jobs[dnf] = pool.submit(
+                run_dnf_transaction, dnf.remove, dnf.install, dnf.allowerasing
+            )
+        if flatpak:
+            progress.step(flatpak.id, "running")
+            jobs[flatpak] = pool.submit(
+                run_flatpak, flatpak.install, prefix="flatpak ┃ "
+            )
+        failed = []
+        for step, job in jobs.items():
+            try:
+                if rc := job.result():
+                    logging.error(f"{step.id} exited with code {rc}")
+            except Exception:
+                logging.exception(f"{step.id} failed")
+                rc = 1
+            progress.step(step.id, "failed" if rc else "done")
+            if rc:
+                failed.append(step.id)
+            else:
+                log.complete(step)
+    if failed:
+        # The post steps set up what dnf5 and flatpak were supposed to
+        # install, and whatever they do gets journaled as done, so they're
+        # left for the run that retries the failed ones
+        if post := log.todo(p.stage("post")):
+            logging.error(f"Not running {', '.join(step.id for step in post)}")
+        raise PayloadError(f"{', '.join(failed)} failed")
+    scheduler.run(log.todo(p.stage("post")), on_done=log.complete)
+
+
+def reachable_apps(apps: dict[str, App]) -> tuple[dict[str, App], dict[str, App]]:
+    """
+    Returns the apps whose repos (or flathub) can be reached right now, and
+    the ones whose can't
+
+    One dead third-party repo would otherwise fail the whole dnf5
+    transaction, so it's better to install the rest and report that app.
+    """
+    urls = {id: netprobe.app_urls(app) for id, app in apps.items()}
+    netprobe.probe([*netprobe.BASE_REPOS, *(u for us in urls.values() for u in us)])
+    ok, skipped = {}, {}
+    for id, app in apps.items():
+        if all(netprobe.reachable(url) for url in urls[id]):
+            ok[id] = app
+        else:
+            logging.error(f"Skipping {app.name}, its sources are not reachable")
+            skipped[id] = app
+    return ok, skipped
+
+
+def run_repos(repos: list[Repo]):
+    """
+    Adds the repos, imports their keys, and fetches their metadata
+
+    The .repo files are written directly instead of through a shell each,
+    every key goes to one `rpm --import`, and dnf5 only refreshes these repos
+    instead of checking every enabled one.
+    """
+    out = util.prefixed("repos ┃ ")
+    for repo in repos:
+        if util.write_file(f"/etc/yum.repos.d/{repo.id}.repo", repo.to_ini()):
+            raise PayloadError(f"Cannot add the {repo.id} repo for {repo.app.name}")
+    if keys := list(dict.fromkeys(repo.gpgkey for repo in repos if repo.gpgkey)):
+        script = "rpm --import " + " ".join(shlex.quote(key) for key in keys)
+        if rc := util.execute(script, on_output=out):
+            raise PayloadError(f"rpm --import exited with code {rc}")
+    # not fatal, the transaction will refresh whatever is missing
+    if rc := run_dnf(
+        "makecache",
+        ["--refresh", *(f"--repo={repo.id}" for repo in repos)],
+        prefix="repos ┃ ",
+    ):
+        logging.warning(f"dnf5 makecache exited with code {rc}")
+
+
+def run_dnf_transaction(
+    remove: Iterable[str], install: Iterable[str], allowerasing: bool = False
+) -> int:
+    """
+    Removes and installs packages in a single dnf5 transaction
+
+    `dnf5 do` takes several actions at once, so dependencies are only
+    resolved once and rpm only goes through one transaction.
+    """
     # WARN: dnf/5 is a giant mess and it will fail
     # somehow someone here please do some proper error handling or sth
     # I don't really know like… how exactly we should do it, but for now
     # I'll just pray that they are just edge cases…
     # -- mado
-    if any(dnfrms):
-        # state.value = DNFRM
-        run_dnf("rm", map(lambda x: x.name, dnfrms))
-    if any(dnfs):
-        # state.value = 0
-        run_dnf("in", map(lambda x: x.name, dnfs))
-    if any(flatpaks):
-        # state.value = FLATPAK
-        run_flatpak(map(lambda x: x.name, flatpaks))
-        # job.value += len(flatpaks)
-    run_special_payloads(apps, lambda payload: payload.priority > 0)
-    time.sleep(5)
-
-
-def run_special_payloads(apps: dict[str, App], filter: Callable[[Payload], bool]):
-    payloads = [p for app in apps.values() for p in app.payloads if filter(p)]
-    payloads.sort(key=lambda p: p.priority)
-    for p in payloads:
-        # state.value = PROC if isinstance(p, Procedure) else SCRIPT
-        # job.value += 1
-        p()
-
-
-def run_dnf(act: str, pkgs: Iterable[str]):
-    global before_dnf
-    # TODO: separate install and download parsing
-    run_with_line_parse(["sudo", "dnf5", act, "-y", *pkgs], line_parse=_dnf5_line_parse)
-
-
-def run_flatpak(pkgs: Iterable[str]):
-    # TODO: implement progress tracking for flatpak
-    # NOTE: I don't think it's actually possible…?
-    run_with_line_parse(
-        ["sudo", "flatpak", "install", "--noninteractive", *pkgs],
-        line_parse=lambda _: None,
+    remove = list(remove)
+    install = list(install)
+    args = ["--allowerasing"] if allowerasing else []
+    if any(remove):
+        args.extend(["--action=remove", *remove])
+    if any(install):
+        args.extend(["--action=install", *install])
+    if not any(remove) and not any(install):
+        return 0
+    return run_dnf("do", args, prefix="dnf5 ┃ ")
+
+
+def run_dnf(act: str, pkgs: Iterable[str], prefix: str = "┃ ") -> int:
+    return run_backend(
+        "dnf5",
+        util.privileged(["dnf5", act, "-y", *pkgcache.dnf_options(), *pkgs]),
+        progress.Dnf5Parser(),
+        prefix,
+    )
+
+
+def run_flatpak(pkgs: Iterable[str], prefix: str = "┃ ") -> int:
+    return run_backend(
+        "flatpak",
+        util.privileged(["flatpak", "install", "--noninteractive", *pkgs]),
+        progress.FlatpakParser(),
+        prefix,
     )
 
 
-def _dnf5_line_parse(line: str):
-    global job, before_dnf, dnf_total
-    if not line.startswith("["):
-        return
-    right = line.find("]")
-    mid = line.find("/")
-    if right == -1 or mid == -1:
-        return
-    # with suppress(ValueError):
-    #     if dnf_total != int(line[mid + 1 : right]):
-    #         # downloading -> installing
-    #         before_dnf = job.value
-    #         if state.value == 0:
-    #             state.value = DNFDL
-    #         elif state.value == DNFDL:
-    #             state.value = DNFIN
-    #         else:
-    #             # FIXME: I don't know
-    #             pass
-    #     job.value = before_dnf + int(line[1:mid])
-
-
-def _just_read(qin: Queue, qres: Queue, fd: IO[bytes]):
-    os.set_blocking(fd.fileno(), False)
-    while True:
-        with suppress(TypeError):
-            if not (r := fd.read(1)):
-                if not qin.empty():
-                    break
-                time.sleep(0.05)
-                continue
-            qres.put_nowait(r)
-    qin.get()
+def run_backend(
+    name: str,
+    cmd: list[str],
+    parser: progress.Dnf5Parser | progress.FlatpakParser,
+    prefix: str,
+) -> int:
+    """
+    Runs dnf5 or flatpak, reporting its progress and timing its phases
+    """
+    # everything before the first progress line is resolving
+    phases = trace.Phases(name)
+    phases.enter("resolve")
+
+    def line_parse(line: str):
+        if event := parser.feed(line):
+            phases.enter(event["phase"])
+            progress.emit(event)
+
+    with trace.span(name, cat="backend", cmd=cmd) as s:
+        rc, transcript = run_with_line_parse(cmd, prefix, line_parse=line_parse, name=name)
+        phases.close(rc)
+        s.set(rc=rc, log=transcript.path)
+    if rc:
+        log_failure(transcript)
+    return rc
+
+
+def log_failure(transcript: capture.Transcript, n: int = 20):
+    # the full output already scrolled past, the end of stderr is usually
+    # what says what went wrong
+    if lines := transcript.recent("err", n):
+        logging.error(f"Last lines from {transcript.name}:\n" + "\n".join(lines))
+    if transcript.path:
+        logging.error(f"Full {transcript.name} log: {transcript.path}")
+
+
+READ_CHUNK = 64 * 1024
+# longest unterminated line kept waiting for its newline
+MAX_LINE = 64 * 1024
+_print_lock = util.print_lock
 
 
 # Copied from terrapkg/mkproj
 def run_with_line_parse(
-    cmd: list[str], prefix: str = "┃ ", *, line_parse: Callable[[str], NoneType]
-) -> tuple[int, str, str]:
-    # TODO: optimizations?
-    print(end=f"\n{prefix}", flush=True)
+    cmd: list[str],
+    prefix: str = "┃ ",
+    *,
+    line_parse: Callable[[str], NoneType],
+    name: str | None = None,
+) -> tuple[int, capture.Transcript]:
+    """
+    Runs a command, echoing its output with a prefix, and returns its exit
+    code and a transcript of the output
+    """
     # Cannot use universal_newlines because it replaces \r with \n
     proc = Popen(cmd, stdout=PIPE, stderr=PIPE, bufsize=0)
     assert proc.stdout
     assert proc.stderr
-    qiout, qierr, qrout, qrerr = Queue(), Queue(), Queue(), Queue()
-    th_out = Process(target=_just_read, args=[qiout, qrout, proc.stdout])
-    th_err = Process(target=_just_read, args=[qierr, qrerr, proc.stderr])
-    th_out.start()
-    th_err.start()
-    line, out, err, tmpout, tmperr = "", "", "", b"", b""
-    while True:
-        while not qrout.empty():
-            tmpout += qrout.get_nowait()
-        with suppress(TypeError):
-            out += (sout := tmpout.decode("utf-8"))
-            line += sout
-            if "\n" in line:
-                [line_parse(ln) for ln in line.splitlines()[:-1]]
-                line = line.splitlines()[-1]
-            tmpout = b""
-            sys.stdout.write(
-                sout.replace("\n", f"\n{prefix}")  # .replace("\r", f"\r{prefix}")
-            )
-        while not qrerr.empty():
-            tmperr += qrerr.get_nowait()
-        with suppress(TypeError):
-            err += (serr := tmperr.decode("utf-8"))
-            tmperr = b""
-            sys.stderr.write(
-                serr.replace("\n", f"\n{prefix}")  # .replace("\r", f"\r{prefix}")
-            )
-        if qrerr.empty() and qrout.empty() and (rc := proc.poll()) is not None:
-            break
-    if len(tmpout) > 0:
-        print(f"Some bytes can't be decoded: {tmpout}")
-    qiout.put(0)
-    qierr.put(0)
-    th_out.join()
-    th_err.join()
-    print()
-    return rc, out, err
+    transcript = capture.Transcript(name or os.path.basename(cmd[0]))
+    # one selector for both pipes; select() blocks until there is data or EOF
+    # (which is what we get once the child exits), so nothing spins here.
+    sel = selectors.DefaultSelector()
+    for fd, sink, stream in (
+        (proc.stdout, sys.stdout, "out"),
+        (proc.stderr, sys.stderr, "err"),
+    ):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        sel.register(fd, selectors.EVENT_READ, [sink, decoder, stream, ""])
+    with transcript:
+        while sel.get_map():
+            for key, _ in sel.select():
+                state = key.data
+                sink, decoder, stream, line = state
+                data = os.read(key.fd, READ_CHUNK)
+                if not data:
+                    sel.unregister(key.fileobj)
+                # a multibyte char split across reads stays in the decoder
+                # until the rest of it arrives
+                line += decoder.decode(data, final=not data)
+                if data:
+                    # keep the unterminated tail around for the next read
+                    complete, newline, state[3] = line.rpartition("\n")
+                    if not newline:
+                        if len(line) <= MAX_LINE:
+                            continue
+                        # a progress bar redrawing with \r forever, don't
+                        # let it pile up
+                        complete, state[3] = line, ""
+                elif not (complete := line):
+                    continue
+                # only \n ends a line. A progress bar redraws itself with \r,
+                # what's shown and logged is how it ended up, the parsers get
+                # the whole thing and pick the redraw they want
+                raw = complete.split("\n")
+                lines = [progress.last_redraw(ln) for ln in raw]
+                with _print_lock:
+                    sink.writelines(f"{prefix}{ln}\n" for ln in lines)
+                    sink.flush()
+                transcript.write(stream, lines)
+                if key.fileobj is proc.stdout:
+                    [line_parse(ln) for ln in raw]
+        sel.close()
+        rc = proc.wait()
+    return rc, transcript
 
 
 if __name__ == "__main__":
@@ -0,0 +1,242 @@
+# Install journal, so an install cut short picks up where it left off
+#
+# Before anything runs, the selection and the plan's steps go to a journal
+# under /var/lib/stellar, and every step that finishes is appended to it.
+# Each record is one JSON line, fsync'd before the installer moves on:
+#
+#   {"event": "plan", "apps": ["steam", "nvidia"], "options": {"nvidia": true},
+#    "attempt": 1, "steps": {"repos": "3f2a…", "dnf": "9c41…", ...}}
+#   {"event": "done", "id": "repos", "digest": "3f2a…"}
+#   {"event": "committed"}
+#
+# If the machine goes down halfway, the journal has no "committed" line. The
+# next run installs the same selection again, and skips the steps it finds
+# done. Steps are matched by a digest of what they do, not just their ID, so
+# a step that changed (another app picked, different hardware) runs again.
+#
+# Each run of the same selection counts as another attempt. A step that can
+# never work (a dead repo, a broken script) would otherwise come back on
+# every boot, so after MAX_ATTEMPTS the install isn't offered for resuming
+# anymore and the next one starts from scratch.
+#
+# A half-written last line (power cut mid-write) is ignored, that step just
+# runs again.
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from . import App
+from .plan import Plan, Step
+
+DONE = "done"
+MAX_ATTEMPTS = int(os.environ.get("STELLAR_RESUME_MAX", "3"))
+
+
+def path(root: str | None = None) -> str:
+    """
+    Returns where the journal of the system being set up lives
+    """
+    root = root or os.environ.get("STELLAR_CHROOT") or "/"
+    return os.environ.get(
+        "STELLAR_JOURNAL", os.path.join(root, "var", "lib", "stellar", "journal.jsonl")
+    )
+
+
+def digest(step: Step) -> str:
+    data = json.dumps(step.to_dict(), sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def read(journal: str) -> list[dict]:
+    """
+    Returns the records of a journal, up to the first broken one
+    """
+    records = []
+    try:
+        with open(journal) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+    except OSError:
+        pass
+    return records
+
+
+class Pending:
+    """An install that was started and never finished."""
+
+    apps: list[str]
+    options: dict[str, bool]
+    done: set[str]
+    attempts: int
+
+    def __init__(
+        self,
+        apps: list[str],
+        options: dict[str, bool],
+        done: set[str],
+        attempts: int = 1,
+    ):
+        self.apps = apps
+        self.options = options
+        self.done = done
+        self.attempts = attempts
+
+    def __repr__(self):
+        return f"Pending(apps={self.apps}, done={len(self.done)}, attempts={self.attempts})"
+
+
+def pending(journal: str | None = None) -> Pending | None:
+    """
+    Returns the unfinished install in the journal, if there is one and it
+    hasn't been tried MAX_ATTEMPTS times already
+    """
+    records = read(journal or path())
+    if not records or records[0].get("event") != "plan" or not records[0].get("apps"):
+        return None
+    if any(r.get("event") == "committed" for r in records):
+        return None
+    unfinished = Pending(
+        list(records[0].get("apps", [])),
+        dict(records[0].get("options", {})),
+        {r["digest"] for r in records if r.get("event") == DONE and "digest" in r},
+        int(records[0].get("attempt", 1)),
+    )
+    if unfinished.attempts >= MAX_ATTEMPTS:
+        logging.warning(
+            f"Giving up on the unfinished install of {', '.join(unfinished.apps)} "
+            f"after {unfinished.attempts} attempts"
+        )
+        return None
+    return unfinished
+
+
+def discard(journal: str | None = None):
+    """
+    Forgets the unfinished install, the next one starts from scratch
+    """
+    journal = journal or path()
+    try:
+        os.unlink(journal)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logging.warning(f"Cannot remove the install journal {journal}: {e}")
+
+
+def _fsync_dir(d: str):
+    fd = os.open(d, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Journal:
+    """The journal of the install that's running."""
+
+    path: str | None
+    done: set[str]
+
+    def __init__(self, journal: str | None = None):
+        # no path, no journal: everything runs and nothing is written
+        self.path = journal
+        self.done = set()
+        self.digests: dict[str, str] = {}
+        self.file = None
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f"Journal(path={self.path}, done={len(self.done)})"
+
+    @classmethod
+    def begin(cls, apps: dict[str, App], p: Plan, journal: str | None = None) -> "Journal":
+        """
+        Starts the journal of an install, carrying over the steps an
+        unfinished earlier one already did
+        """
+        j = cls(journal or path(p.root))
+        j.digests = {step.id: digest(step) for step in p.steps}
+        options = {id: app.option.option for id, app in apps.items() if app.option}
+        attempt = 1
+        if prev := pending(j.path):
+            j.done = prev.done & set(j.digests.values())
+            # picking something else is a new install, not another try
+            if sorted(prev.apps) == sorted(apps) and prev.options == options:
+                attempt = prev.attempts + 1
+        if j.done:
+            skipped = [id for id, d in j.digests.items() if d in j.done]
+            logging.info(f"Resuming an unfinished install, skipping {', '.join(skipped)}")
+        records = [
+            {
+                "event": "plan",
+                "apps": list(apps),
+                "options": options,
+                "attempt": attempt,
+                "steps": j.digests,
+            },
+            *(
+                {"event": DONE, "id": id, "digest": d}
+                for id, d in j.digests.items()
+                if d in j.done
+            ),
+        ]
+        assert j.path
+        try:
+            d = os.path.dirname(j.path)
+            os.makedirs(d, exist_ok=True)
+            # the old journal stays until the new one is safely on disk
+            tmp = f"{j.path}.{os.getpid()}"
+            with open(tmp, "w") as f:
+                f.writelines(json.dumps(r) + "\n" for r in records)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, j.path)
+            _fsync_dir(d)
+            j.file = open(j.path, "a")
+        except OSError as e:
+            logging.warning(
+                f"Cannot write the install journal {j.path}: {e}, "
+                "an interrupted install will start over"
+            )
+            j.path = None
+        return j
+
+    def _append(self, record: dict):
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def finished(self, step: Step) -> bool:
+        return self.digests.get(step.id, digest(step)) in self.done
+
+    def todo(self, steps: list[Step]) -> list[Step]:
+        """
+        Returns the steps that still have to run
+        """
+        return [step for step in steps if not self.finished(step)]
+
+    def complete(self, step: Step):
+        d = self.digests.get(step.id) or digest(step)
+        self.done.add(d)
+        self._append({"event": DONE, "id": step.id, "digest": d})
+
+    def commit(self):
+        """
+        Marks the install as finished, nothing gets resumed after this
+        """
+        self._append({"event": "committed"})
+        self.close()
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
@@ -0,0 +1,198 @@
+# Network readiness and repo reachability checks
+#
+# Every repo an install is going to need gets a HEAD request, all at the same
+# time and with a short timeout, so a captive portal or a dead mirror shows up
+# in a few seconds instead of as a hung dnf5 later on. URLs on the same host
+# share one keep-alive connection. Results are kept for the rest of the
+# process, so later stages can just look them up.
+import asyncio
+import logging
+import os
+import platform
+import re
+import ssl
+import time
+import urllib.parse
+
+from . import App, Flatpak, Repo, Script, trace
+
+TIMEOUT = 3.0
+
+# plain "are we online at all" check
+CONNECTIVITY_URL = "https://ultramarine-linux.org/"
+FLATHUB = "https://dl.flathub.org/repo/config"
+# repos every install uses, whatever apps are picked
+BASE_REPOS = [
+    "https://mirrors.fedoraproject.org/metalink?repo=fedora-$releasever&arch=$basearch",
+    "https://repos.fyralabs.com/um$releasever/repodata/repomd.xml",
+    "https://repos.fyralabs.com/terra$releasever/repodata/repomd.xml",
+]
+
+_REPO_URL = re.compile(r"(baseurl=|--add-repo\s+)[\"']?([^\s\"']+)")
+
+
+class Result:
+    """Outcome of probing a single URL."""
+
+    url: str
+    status: int | None
+    latency: float | None
+    error: str | None
+
+    def __init__(
+        self,
+        url: str,
+        status: int | None = None,
+        latency: float | None = None,
+        error: str | None = None,
+    ):
+        self.url = url
+        self.status = status
+        self.latency = latency
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        # any answer means the server is there, plenty of them refuse HEAD
+        # (403, 405) and serve GET just fine; only connection errors and
+        # timeouts count
+        return self.status is not None
+
+    def __repr__(self):
+        return f"Result(url={self.url}, status={self.status}, latency={self.latency}, error={self.error})"
+
+
+# results for this session, by URL
+results: dict[str, Result] = {}
+
+
+def releasever() -> str:
+    root = os.environ.get("STELLAR_CHROOT") or "/"
+    try:
+        with open(os.path.join(root, "etc", "os-release")) as f:
+            for line in f:
+                if line.startswith("VERSION_ID="):
+                    return line.split("=", 1)[1].strip().strip('"')
+    except OSError:
+        pass
+    return ""
+
+
+def expand(url: str) -> str:
+    """
+    Fills in the dnf variables in a repo URL
+    """
+    return (
+        url.replace("\\", "")
+        .replace("$basearch", platform.machine())
+        .replace("$releasever", releasever())
+    )
+
+
+def app_urls(app: App) -> list[str]:
+    """
+    Returns the URLs an app needs to be reachable to install
+    """
+    urls = []
+    for payload in app.payloads:
+        if isinstance(payload, Flatpak):
+            urls.append(FLATHUB)
+        elif isinstance(payload, Repo):
+            urls.append(expand(payload.baseurl).rstrip("/") + "/repodata/repomd.xml")
+        elif isinstance(payload, Script):
+            for kind, url in _REPO_URL.findall(payload.script):
+                url = expand(url)
+                # --add-repo takes either a .repo file or a baseurl
+                if kind == "baseurl=" or not url.endswith(".repo"):
+                    url = url.rstrip("/") + "/repodata/repomd.xml"
+                urls.append(url)
+    return list(dict.fromkeys(urls))
+
+
+async def _head(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, url: str
+) -> tuple[int, bool]:
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    writer.write(
+        f"HEAD {path} HTTP/1.1\r\nHost: {parts.hostname}\r\n"
+        "User-Agent: stellar\r\nConnection: keep-alive\r\n\r\n".encode()
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    keep = True
+    while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+        if line.lower().startswith(b"connection:") and b"close" in line.lower():
+            keep = False
+    return status, keep
+
+
+async def _probe_host(urls: list[str], timeout: float) -> list[Result]:
+    parts = urllib.parse.urlsplit(urls[0])
+    https = parts.scheme == "https"
+    host = parts.hostname or ""
+    port = parts.port or (443 if https else 80)
+    ctx = ssl.create_default_context() if https else None
+    writer = None
+    out = []
+    for url in urls:
+        start = time.monotonic()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(host, port, ssl=ctx), timeout
+                )
+            status, keep = await asyncio.wait_for(_head(reader, writer, url), timeout)
+            out.append(Result(url, status, time.monotonic() - start))
+        except (OSError, asyncio.TimeoutError, ValueError, IndexError) as e:
+            out.append(Result(url, error=str(e) or type(e).__name__))
+            keep = False
+        if not keep and writer is not None:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+    return out
+
+
+async def _probe(urls: list[str], timeout: float) -> list[Result]:
+    by_host: dict[tuple[str, str | None, int | None], list[str]] = {}
+    for url in urls:
+        parts = urllib.parse.urlsplit(url)
+        by_host.setdefault((parts.scheme, parts.hostname, parts.port), []).append(url)
+    done = await asyncio.gather(*(_probe_host(u, timeout) for u in by_host.values()))
+    return [res for host in done for res in host]
+
+
+@trace.traced("netprobe", cat="probe")
+def probe(urls: list[str], timeout: float = TIMEOUT) -> dict[str, Result]:
+    """
+    Probes all URLs at once, skipping the ones already probed this session
+    """
+    urls = [expand(url) for url in urls]
+    if todo := [url for url in dict.fromkeys(urls) if url not in results]:
+        for res in asyncio.run(_probe(todo, timeout)):
+            results[res.url] = res
+            if not res.ok:
+                logging.warning(f"{res.url} is not reachable: {res.error or res.status}")
+    return {url: results[url] for url in urls}
+
+
+def reachable(url: str) -> bool:
+    """
+    Returns False if the URL was probed and didn't work
+
+    URLs that weren't probed are assumed to be fine.
+    """
+    res = results.get(expand(url))
+    return res is None or res.ok
+
+
+def online(timeout: float = TIMEOUT) -> bool:
+    """
+    Returns True if we can reach the internet, and warms up the results for
+    the base repos on the way
+    """
+    return any(res.ok for res in probe([CONNECTIVITY_URL, *BASE_REPOS], timeout).values())
@@ -0,0 +1,60 @@
+# Sharing the dnf5 cache between the installer environment and the target
+#
+# In kickstart mode (STELLAR_CHROOT), dnf5 runs inside the freshly installed
+# system, with an empty cache. The installer environment usually has the same
+# repos already cached, and on imaging benches the host cache survives from
+# one install to the next, so we bind-mount it into the target for the run.
+import contextlib
+import logging
+import os
+import subprocess
+
+HOST_CACHE = os.environ.get("STELLAR_HOST_CACHE", "/var/cache/libdnf5")
+TARGET_CACHE = os.path.join("var", "cache", "libdnf5")
+
+# set while the host cache is mounted into the target
+shared = False
+
+
+@contextlib.contextmanager
+def shared_cache(root: str | None = None):
+    """
+    Bind-mounts the host dnf5 cache into the target root while in the block
+
+    Does nothing when not installing into a chroot, or if mounting fails.
+    """
+    global shared
+    root = root or os.environ.get("STELLAR_CHROOT")
+    if not root or shared:
+        yield
+        return
+    target = os.path.join(root, TARGET_CACHE)
+    try:
+        os.makedirs(HOST_CACHE, exist_ok=True)
+        os.makedirs(target, exist_ok=True)
+    except OSError as e:
+        logging.warning(f"Cannot share dnf cache with {root}: {e}")
+        yield
+        return
+    if subprocess.call(["mount", "--bind", HOST_CACHE, target]) != 0:
+        logging.warning(f"Cannot bind-mount {HOST_CACHE} to {target}")
+        yield
+        return
+    logging.info(f"Sharing {HOST_CACHE} with {target}")
+    shared = True
+    try:
+        yield
+    finally:
+        shared = False
+        if subprocess.call(["umount", target]) != 0:
+            # something in the chroot is still holding it
+            subprocess.call(["umount", "--lazy", target])
+
+
+def dnf_options() -> list[str]:
+    """
+    Returns extra dnf5 options for the current cache setup
+    """
+    # dnf5 drops downloaded packages after a successful transaction, but the
+    # next install from this host should be able to reuse them
+    return ["--setopt=keepcache=True"] if shared else []
@@ -0,0 +1,202 @@
+# Install plans
+#
+# A selection of apps is compiled into a Plan: an ordered list of steps, each
+# tagged with the stage it runs in:
+#
+#   pre      Script/Procedure payloads with a negative priority
+#   repos    writes every Repo payload, imports their keys, refreshes them
+#   dnf      one dnf5 transaction with every package to remove and install,
+#            with --allowerasing for all of it if any DynamicDnf asks for it
+#   flatpak  one flatpak install with every Flatpak payload
+#   post     the remaining Script/Procedure payloads, by priority
+#
+# dnf and flatpak run at the same time, everything else in order. The plan is
+# all the installer looks at, and it can be dumped to JSON (`umstellar
+# install --dry-run`) to see what would run without running it.
+import json
+import os
+import typing
+
+from . import App, Dnf, DnfRm, DynamicDnf, Flatpak, Payload, Procedure, Repo, Script, trace
+
+STAGES = ("pre", "repos", "dnf", "flatpak", "post")
+
+
+class Step:
+    """One thing the installer does."""
+
+    id: str
+    stage: str
+    kind: str
+    app: str | None
+    priority: int
+    payload: Payload | None
+    remove: list[str]
+    install: list[str]
+    prefetch: list[str]
+    allowerasing: bool
+    repos: list[Repo]
+
+    def __init__(
+        self,
+        id: str,
+        stage: str,
+        kind: str,
+        app: str | None = None,
+        priority: int = 0,
+        payload: Payload | None = None,
+        remove: list[str] | None = None,
+        install: list[str] | None = None,
+        prefetch: list[str] | None = None,
+        allowerasing: bool = False,
+        repos: list[Repo] | None = None,
+    ):
+        self.id = id
+        self.stage = stage
+        self.kind = kind
+        self.app = app
+        self.priority = priority
+        self.payload = payload
+        self.remove = remove or []
+        self.install = install or []
+        self.prefetch = prefetch or []
+        self.allowerasing = allowerasing
+        self.repos = repos or []
+
+    def __repr__(self):
+        return f"Step(id={self.id}, stage={self.stage}, kind={self.kind})"
+
+    def to_dict(self) -> dict[str, typing.Any]:
+        d: dict[str, typing.Any] = {"id": self.id, "stage": self.stage, "kind": self.kind}
+        match self.payload:
+            case Script():
+                d |= {"app": self.app, "priority": self.priority}
+                d["script"] = self.payload.script
+            case Procedure():
+                d |= {"app": self.app, "priority": self.priority}
+                d["function"] = f"{self.payload.f.__module__}.{self.payload.f.__qualname__}"
+        if self.kind == "dnf":
+            d |= {
+                "remove": self.remove,
+                "install": self.install,
+                "prefetch": self.prefetch,
+                "allowerasing": self.allowerasing,
+            }
+        elif self.kind == "flatpak":
+            d["install"] = self.install
+        elif self.kind == "repos":
+            d["repos"] = [{"id": repo.id, "file": repo.to_ini()} for repo in self.repos]
+        return d
+
+
+class Plan:
+    """Everything an install is going to do, in order."""
+
+    root: str
+    apps: list[str]
+    steps: list[Step]
+
+    def __init__(self, root: str, apps: list[str], steps: list[Step]):
+        self.root = root
+        self.apps = apps
+        self.steps = steps
+
+    def stage(self, name: str) -> list[Step]:
+        return [step for step in self.steps if step.stage == name]
+
+    def step(self, id: str) -> Step | None:
+        return next((step for step in self.steps if step.id == id), None)
+
+    def to_dict(self) -> dict[str, typing.Any]:
+        return {
+            "root": self.root,
+            "apps": self.apps,
+            "steps": [step.to_dict() for step in self.steps],
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+
+@trace.traced("plan.build", cat="plan")
+def build(apps: dict[str, App]) -> Plan:
+    """
+    Compiles a selection of apps into a plan
+
+    DynamicDnf payloads are resolved here, so this might probe the hardware.
+    """
+    remove: list[str] = []
+    install: list[str] = []
+    # packages from apps that don't set up a repo first, so they can be
+    # downloaded while the pre stage runs
+    prefetch: list[str] = []
+    flatpaks: list[str] = []
+    repos: dict[str, Repo] = {}
+    allowerasing = False
+    special: list[Step] = []
+    for id, app in apps.items():
+        # apps that set up a repo first get their packages from that repo
+        early = not any(
+            p.priority < 0 or isinstance(p, Repo) for p in app.payloads
+        )
+        for i, payload in enumerate(app.payloads):
+            match payload:
+                case DnfRm():
+                    remove.append(payload.name)
+                case Dnf():
+                    install.append(payload.name)
+                    if early:
+                        prefetch.append(payload.name)
+                case DynamicDnf():
+                    install.extend(payload.resolve())
+                    if early:
+                        prefetch.extend(payload.resolve())
+                    # dnf5 only takes it for the whole transaction, so it
+                    # lets the Nvidia drivers replace what's in their way,
+                    # and any other app's packages too (see --dry-run)
+                    allowerasing |= payload.allowerasing
+                case Flatpak():
+                    flatpaks.append(payload.name)
+                case Repo():
+                    # several apps can share a repo, it only needs adding once
+                    repos.setdefault(payload.id, payload)
+                case Script() | Procedure():
+                    stage = "pre" if payload.priority < 0 else "post"
+                    special.append(
+                        Step(
+                            id=f"{stage}/{id}/{i}",
+                            stage=stage,
+                            kind="script" if isinstance(payload, Script) else "procedure",
+                            app=id,
+                            priority=payload.priority,
+                            payload=payload,
+                        )
+                    )
+    install = list(dict.fromkeys(install))
+    # if something wants a package gone and something else wants it, keep it
+    remove = [pkg for pkg in dict.fromkeys(remove) if pkg not in install]
+    # sorted() is stable, so same-priority payloads keep the catalog order
+    special.sort(key=lambda step: step.priority)
+    steps = [step for step in special if step.stage == "pre"]
+    if repos:
+        steps.append(
+            Step(id="repos", stage="repos", kind="repos", repos=list(repos.values()))
+        )
+    if remove or install:
+        steps.append(
+            Step(
+                id="dnf",
+                stage="dnf",
+                kind="dnf",
+                remove=remove,
+                install=install,
+                prefetch=list(dict.fromkeys(prefetch)),
+                allowerasing=allowerasing,
+            )
+        )
+    if flatpaks:
+        steps.append(
+            Step(id="flatpak", stage="flatpak", kind="flatpak", install=list(dict.fromkeys(flatpaks)))
+        )
+    steps.extend(step for step in special if step.stage == "post")
+    return Plan(os.environ.get("STELLAR_CHROOT") or "/", list(apps), steps)
@@ -0,0 +1,176 @@
+# Speculative downloads of the apps being ticked
+#
+# Ticking an app queues a download of its packages: `dnf5 install
+# --downloadonly` for its dnf packages and `flatpak install --no-deploy` for
+# its flatpaks. One background worker goes through the queue at idle
+# priority, so by the time Install Selections is pressed most of the bytes
+# are already in the dnf and flatpak caches.
+#
+# Apps that set up a third-party repo first are skipped, their packages
+# can't be found before the repo exists. Unticking an app drops it from the
+# queue, or stops its download if it's already running.
+import logging
+import subprocess
+import threading
+from collections import OrderedDict
+
+from . import App, Dnf, DynamicDnf, Flatpak, Repo, warmup
+
+# how many apps can wait in the queue, ticking more than that just doesn't
+# prefetch the extra ones
+MAX_PENDING = 32
+
+
+class Job:
+    """The downloads for one app."""
+
+    id: str
+    cmds: list[list[str]]
+
+    def __init__(self, id: str, cmds: list[list[str]] | None = None):
+        self.id = id
+        self.cmds = cmds or []
+        self.proc: subprocess.Popen | None = None
+        self.cancelled = False
+
+    def __repr__(self):
+        return f"Job(id={self.id}, cmds={self.cmds})"
+
+    def run(self):
+        for cmd in self.cmds:
+            if self.cancelled:
+                return
+            try:
+                self.proc = subprocess.Popen(
+                    cmd,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    stdin=subprocess.DEVNULL,
+                )
+                if self.cancelled:
+                    # unticked while it was starting
+                    self.proc.terminate()
+                rc = self.proc.wait()
+            except OSError as e:
+                logging.debug(f"Cannot prefetch {self.id}: {e}")
+                return
+            if rc and not self.cancelled:
+                # the real install will just download it again
+                logging.debug(f"Prefetch of {self.id} exited with code {rc}")
+
+    def cancel(self):
+        self.cancelled = True
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
+
+
+def commands(app: App) -> list[list[str]]:
+    """
+    Returns the download commands for an app, or nothing if it can't be
+    prefetched
+    """
+    if any(p.priority < 0 or isinstance(p, Repo) for p in app.payloads):
+        return []
+    pkgs: list[str] = []
+    flatpaks: list[str] = []
+    for payload in app.payloads:
+        match payload:
+            case Dnf():
+                pkgs.append(payload.name)
+            case DynamicDnf():
+                pkgs.extend(payload.resolve())
+            case Flatpak():
+                flatpaks.append(payload.name)
+    cmds = []
+    if pkgs:
+        cmds.append(warmup.background(["dnf5", "install", "-y", "--downloadonly", *pkgs]))
+    if flatpaks:
+        cmds.append(
+            warmup.background(
+                ["flatpak", "install", "--noninteractive", "--no-deploy", *flatpaks]
+            )
+        )
+    return cmds
+
+
+class Prefetcher:
+    """A queue of apps to download, worked through one at a time."""
+
+    def __init__(self):
+        self.pending: OrderedDict[str, App] = OrderedDict()
+        self.running: Job | None = None
+        self.stopped = False
+        self.cond = threading.Condition()
+        self.worker: threading.Thread | None = None
+
+    def enqueue(self, id: str, app: App):
+        with self.cond:
+            if self.stopped or id in self.pending:
+                return
+            if self.running and self.running.id == id:
+                return
+            if len(self.pending) >= MAX_PENDING:
+                logging.debug(f"Prefetch queue is full, not prefetching {id}")
+                return
+            self.pending[id] = app
+            if self.worker is None:
+                self.worker = threading.Thread(
+                    target=self.work, name="stellar-prefetch", daemon=True
+                )
+                self.worker.start()
+            self.cond.notify()
+
+    def cancel(self, id: str):
+        with self.cond:
+            self.pending.pop(id, None)
+            if self.running and self.running.id == id:
+                self.running.cancel()
+
+    def stop(self, wait: bool = True):
+        """
+        Drops everything still queued, and waits for the running download,
+        or stops it too if not waiting
+        """
+        with self.cond:
+            self.stopped = True
+            self.pending.clear()
+            if self.running and not wait:
+                self.running.cancel()
+            self.cond.notify()
+            worker = self.worker
+        if wait and worker:
+            worker.join()
+
+    def work(self):
+        # the first download would refresh the metadata on its own otherwise,
+        # next to the warm-up
+        warmup.wait()
+        while True:
+            with self.cond:
+                while not self.pending and not self.stopped:
+                    self.cond.wait()
+                if self.stopped:
+                    return
+                id, app = self.pending.popitem(last=False)
+                # running as far as cancel() is concerned from here on
+                job = self.running = Job(id)
+            job.cmds = commands(app)
+            logging.debug(f"Prefetching {id}")
+            job.run()
+            with self.cond:
+                self.running = None
+
+
+_prefetcher = Prefetcher()
+
+
+def enqueue(id: str, app: App):
+    _prefetcher.enqueue(id, app)
+
+
+def cancel(id: str):
+    _prefetcher.cancel(id)
+
+
+def stop(wait: bool = True):
+    _prefetcher.stop(wait)
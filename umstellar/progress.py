@@ -0,0 +1,192 @@
+# Install progress events
+#
+# The installer reports what it's doing as JSON lines on a file descriptor
+# (`umstellar install --progress-fd N`), which the GUI reads from the other
+# end of a pipe. One object per line:
+#
+#   {"event": "plan", "steps": [{"id": "dnf", "stage": "dnf"}, ...]}
+#   {"event": "step", "id": "dnf", "state": "running"}   # or "done", "failed"
+#   {"event": "progress", "backend": "dnf5", "phase": "download",
+#    "done": 3, "total": 12, "item": "steam-1.0.0.78-1.fc39.i686.rpm"}
+#   {"event": "skipped", "apps": ["vscode"]}   # sources not reachable
+#   {"event": "finished", "rc": 0}
+#
+# The parsers turn dnf5 and flatpak output lines into "progress" events.
+# Without a progress fd, emitting does nothing.
+import json
+import os
+import re
+import threading
+import typing
+
+# dnf5 numbers every line of both the download and the transaction as
+# "[ n/total] ...", the text tells which phase it is
+_DNF5 = re.compile(r"^\[\s*(\d+)/(\d+)\]\s*(.*?)\s*$")
+_DNF5_PHASES = [
+    ("scriptlets", re.compile(r"^Running\b.*\bscriptlet", re.I)),
+    ("verify", re.compile(r"^Verify(ing)? package", re.I)),
+    ("prepare", re.compile(r"^Prepar(e|ing) transaction", re.I)),
+    (
+        "install",
+        re.compile(
+            r"^(Installing|Upgrading|Downgrading|Reinstalling|Removing|Erasing|Cleanup|Replacing)\b",
+            re.I,
+        ),
+    ),
+]
+_COLUMNS = re.compile(r"\s+(\d+%|\|).*$")
+# flatpak --noninteractive prints "Installing 1/3… 45%  1.2 MB/s  00:10"
+_FLATPAK = re.compile(
+    r"^(Installing|Updating|Uninstalling)\s+(\d+)/(\d+)(?:\D*?(\d+)%)?", re.I
+)
+# and which ref it's on in "Installing app/org.foo.Bar/x86_64/stable"
+_FLATPAK_REF = re.compile(r"^(?:Installing|Updating)\s+((?:app|runtime)/\S+)", re.I)
+
+
+def last_redraw(line: str) -> str:
+    """
+    Returns what a line that redraws itself with \r ends up showing
+    """
+    if "\r" not in line:
+        return line
+    parts = [part for part in line.split("\r") if part.strip()]
+    return parts[-1] if parts else ""
+
+
+class Dnf5Parser:
+    """Turns dnf5 output lines into progress events."""
+
+    def feed(self, line: str) -> dict | None:
+        if not (m := _DNF5.match(last_redraw(line).strip())):
+            return None
+        done, total, rest = int(m[1]), int(m[2]), m[3]
+        phase = "download"
+        for name, pattern in _DNF5_PHASES:
+            if pattern.match(rest):
+                phase = name
+                break
+        # drop the "100% | 1.2 MiB/s | ..." columns
+        item = _COLUMNS.sub("", rest)
+        return {
+            "event": "progress",
+            "backend": "dnf5",
+            "phase": phase,
+            "done": done,
+            "total": total,
+            "item": item,
+        }
+
+
+class FlatpakParser:
+    """Turns flatpak output lines into progress events."""
+
+    def __init__(self):
+        self.item = ""
+
+    def feed(self, line: str) -> dict | None:
+        line = last_redraw(line).strip()
+        if m := _FLATPAK_REF.match(line):
+            self.item = m[1]
+        if not (m := _FLATPAK.match(line)):
+            return None
+        event: dict[str, typing.Any] = {
+            "event": "progress",
+            "backend": "flatpak",
+            "phase": m[1].lower(),
+            "done": int(m[2]) - 1,
+            "total": int(m[3]),
+            "item": self.item,
+        }
+        if m[4] is not None:
+            event["percent"] = int(m[4])
+            if event["percent"] == 100:
+                event["done"] += 1
+        return event
+
+
+class Reporter:
+    """Writes events to a file descriptor."""
+
+    def __init__(self, fd: int):
+        self.file = os.fdopen(fd, "w", buffering=1)
+        self.lock = threading.Lock()
+
+    def emit(self, event: dict):
+        line = json.dumps(event) + "\n"
+        with self.lock:
+            try:
+                self.file.write(line)
+            except (BrokenPipeError, ValueError):
+                # nobody is listening any more, carry on with the install
+                pass
+
+
+# where events go, if anywhere
+reporter: Reporter | None = None
+
+
+def open_fd(fd: int):
+    global reporter
+    reporter = Reporter(fd)
+
+
+def emit(event: dict | None):
+    if event is not None and reporter is not None:
+        reporter.emit(event)
+
+
+def step(id: str, state: str):
+    emit({"event": "step", "id": id, "state": state})
+
+
+class State:
+    """
+    What the install is doing, built up from events
+
+    Events can come in much faster than they can be drawn, so the GUI folds
+    them into this and only redraws every so often.
+    """
+
+    def __init__(self):
+        self.steps: dict[str, str] = {}
+        self.stages: dict[str, str] = {}
+        self.backends: dict[str, dict] = {}
+        self.skipped: list[str] = []
+        self.rc: int | None = None
+
+    def apply(self, event: dict):
+        match event.get("event"):
+            case "plan":
+                self.steps = {s["id"]: "pending" for s in event["steps"]}
+                self.stages = {s["id"]: s["stage"] for s in event["steps"]}
+            case "step":
+                self.steps[event["id"]] = event["state"]
+            case "progress":
+                self.backends[event["backend"]] = event
+            case "skipped":
+                self.skipped = list(event["apps"])
+            case "finished":
+                self.rc = event["rc"]
+
+    def fraction(self) -> float:
+        """
+        Returns how far the whole install is, from 0 to 1
+        """
+        if not self.steps:
+            return 0.0
+        done = sum(state in ("done", "failed") for state in self.steps.values())
+        # give the running backends partial credit
+        for backend, ev in self.backends.items():
+            if self.steps.get(_STEP.get(backend, "")) == "running" and ev["total"]:
+                done += min(ev["done"] / ev["total"], 1) * 0.99
+        return min(done / len(self.steps), 1.0)
+
+    def running(self) -> list[str]:
+        return [id for id, state in self.steps.items() if state == "running"]
+
+    def failed(self) -> list[str]:
+        return [id for id, state in self.steps.items() if state == "failed"]
+
+
+# which plan step each backend belongs to
+_STEP = {"dnf5": "dnf", "flatpak": "flatpak"}
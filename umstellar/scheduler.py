@@ -0,0 +1,118 @@
+# Runs the Script/Procedure steps of a stage, in parallel where it's safe
+#
+# Every payload touches some resources. A step waits for the earlier steps in
+# the plan (so lower or equal priority) that share one with it, and runs at
+# the same time as everything else. Payloads can list their resources, and
+# otherwise get:
+# - "app:<id>", so the payloads of one app still run in order
+# - "rpmdb" for scripts calling dnf or rpm, which take the rpm lock
+# - "flatpak" for scripts calling flatpak
+# - "*" for Procedures, which run Python code that can do anything, and so
+#   run alone
+#
+# When a step fails, nothing new is started, the running steps are waited
+# for, and the first error is raised.
+import logging
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable
+
+from . import PayloadError, Procedure, Script, progress, trace, util
+from .plan import Step
+
+WORKERS = int(os.environ.get("STELLAR_JOBS", "4"))
+EVERYTHING = "*"
+
+# the commands themselves, not /etc/yum.repos.d or .../linux/rpm/stable URLs
+_RPMDB = re.compile(r"(?:^|[\s;&|(`])(?:dnf5?|rpm)\s")
+_FLATPAK = re.compile(r"(?:^|[\s;&|(`])flatpak\s")
+
+
+def resources(step: Step) -> set[str]:
+    """
+    Returns what a step's payload touches
+    """
+    payload = step.payload
+    if payload is not None and payload.resources is not None:
+        found = set(payload.resources)
+    elif isinstance(payload, Procedure):
+        found = {EVERYTHING}
+    else:
+        found = set()
+        if isinstance(payload, Script):
+            if _RPMDB.search(payload.script):
+                found.add("rpmdb")
+            if _FLATPAK.search(payload.script):
+                found.add("flatpak")
+    found.add(f"app:{step.app}")
+    return found
+
+
+def conflicts(a: set[str], b: set[str]) -> bool:
+    return EVERYTHING in a or EVERYTHING in b or bool(a & b)
+
+
+def dependencies(steps: list[Step]) -> dict[str, set[str]]:
+    """
+    Returns the IDs of the steps each step has to wait for
+    """
+    res = [resources(step) for step in steps]
+    return {
+        step.id: {steps[j].id for j in range(i) if conflicts(res[i], res[j])}
+        for i, step in enumerate(steps)
+    }
+
+
+def run_step(step: Step):
+    with trace.span(step.id, cat="payload", app=step.app, kind=step.kind):
+        step.payload(on_output=util.prefixed(f"{step.app} ┃ "))
+
+
+def run(
+    steps: list[Step],
+    workers: int = WORKERS,
+    on_done: Callable[[Step], None] | None = None,
+):
+    """
+    Runs the steps, raising PayloadError if any of them fails
+
+    on_done is called with each step that succeeded, from this thread.
+    """
+    if not steps:
+        return
+    deps = dependencies(steps)
+    pending = list(steps)
+    running: dict[Future, Step] = {}
+    done: set[str] = set()
+    error: tuple[Step, Exception] | None = None
+    with ThreadPoolExecutor(workers, thread_name_prefix="stellar-payload") as pool:
+        while pending or running:
+            if error is None:
+                for step in [s for s in pending if deps[s.id] <= done]:
+                    pending.remove(step)
+                    logging.debug(f"Starting {step.id}")
+                    progress.step(step.id, "running")
+                    running[pool.submit(run_step, step)] = step
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                try:
+                    future.result()
+                    done.add(step.id)
+                    progress.step(step.id, "done")
+                    if on_done:
+                        on_done(step)
+                except Exception as e:
+                    logging.error(f"{step.id} failed: {e}")
+                    progress.step(step.id, "failed")
+                    error = error or (step, e)
+    if error:
+        step, e = error
+        if pending:
+            logging.error(f"Not running {', '.join(s.id for s in pending)}")
+        if isinstance(e, PayloadError):
+            raise e
+        raise PayloadError(f"{step.id} failed: {e}") from e
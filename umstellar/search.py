@@ -0,0 +1,85 @@
+# Catalog search
+#
+# An inverted index from words to app IDs, built once from the catalog. Words
+# come from the app ID, name and description, and the names of its Dnf and
+# Flatpak payloads. The vocabulary is kept sorted, so every word starting
+# with a query word is one bisect away, and a keystroke never has to look at
+# apps that don't match.
+import bisect
+import functools
+import re
+
+from . import App, Dnf, Flatpak
+
+_WORD = re.compile(r"[^\W_]+")
+
+# how much a match counts, depending on where the word was found
+WEIGHTS = {"id": 4, "name": 4, "package": 2, "description": 1}
+
+
+def tokenize(text: str) -> list[str]:
+    return _WORD.findall(text.casefold())
+
+
+class Index:
+    """Inverted index over the apps of a catalog."""
+
+    words: list[str]
+    postings: dict[str, dict[str, int]]
+    order: dict[str, int]
+
+    def __init__(self, apps: dict[str, App]):
+        self.postings = {}
+        # catalog order, to break ties
+        self.order = {id: i for i, id in enumerate(apps)}
+        for id, app in apps.items():
+            fields = [("id", id), ("name", app.name), ("description", app.description)]
+            for p in app.payloads:
+                if isinstance(p, (Dnf, Flatpak)):
+                    fields.append(("package", p.name))
+            for field, text in fields:
+                for word in tokenize(text):
+                    hits = self.postings.setdefault(word, {})
+                    hits[id] = max(hits.get(id, 0), WEIGHTS[field])
+        self.words = sorted(self.postings)
+
+    @functools.lru_cache(maxsize=256)
+    def prefix(self, word: str) -> dict[str, int]:
+        """
+        Returns the apps with a word starting with the given one, and how well
+        they match
+        """
+        found: dict[str, int] = {}
+        i = bisect.bisect_left(self.words, word)
+        while i < len(self.words) and self.words[i].startswith(word):
+            # whole word matches count double
+            bonus = 2 if self.words[i] == word else 1
+            for id, weight in self.postings[self.words[i]].items():
+                found[id] = max(found.get(id, 0), weight * bonus)
+            i += 1
+        return found
+
+    def search(self, query: str) -> list[str]:
+        """
+        Returns the IDs of the apps matching every word of the query, best
+        matches first
+        """
+        words = tokenize(query)
+        if not words:
+            return []
+        # start from the rarest word, so the intersection stays small
+        hits = sorted((self.prefix(w) for w in words), key=len)
+        scores = dict(hits[0])
+        for other in hits[1:]:
+            scores = {id: s + other[id] for id, s in scores.items() if id in other}
+        return sorted(scores, key=lambda id: (-scores[id], self.order[id]))
+
+
+@functools.cache
+def index() -> Index:
+    """
+    Returns the index for the catalog
+    """
+    from . import catalog
+
+    return Index(catalog.load().apps)
@@ -0,0 +1,222 @@
+# Timing spans, to see where the time goes
+#
+# Set STELLAR_TRACE=/path/to/trace.json and every span (catalog load, GUI
+# build, each payload, each dnf5/flatpak phase, the hardware and network
+# probes) is recorded with its wall time, CPU time and how it ended. On exit
+# they're written out as Chrome trace-event JSON, which chrome://tracing and
+# ui.perfetto.dev open, and a summary table is logged, slowest first.
+#
+# CPU time is the time of the thread running the span, plus the CPU time of
+# the child processes reaped during it. Children are counted for the whole
+# process, so when dnf5 and flatpak run side by side, whichever span is open
+# when the other one's child exits gets its CPU time too.
+#
+# Without STELLAR_TRACE, spans still time themselves but aren't kept.
+import atexit
+import contextlib
+import functools
+import os
+import resource
+import threading
+import time
+from typing import Any, Callable, Iterator
+
+TRACE = os.environ.get("STELLAR_TRACE")
+
+OK = "ok"
+FAILED = "failed"
+ERROR = "error"
+
+# trace timestamps count from here
+_origin = time.perf_counter()
+
+
+def _children_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Span:
+    """One timed thing."""
+
+    name: str
+    cat: str
+    args: dict[str, Any]
+    status: str | None
+    wall: float | None
+    cpu: float | None
+
+    def __init__(self, name: str, cat: str = "stellar", **args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.status = None
+        self.wall = None
+        self.cpu = None
+        self.tid = threading.get_ident()
+        self.start = time.perf_counter()
+        self._cpu = time.thread_time()
+        self._children = _children_cpu()
+
+    def __repr__(self):
+        return f"Span(name={self.name}, cat={self.cat}, status={self.status})"
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def end(self, status: str | None = None):
+        if self.wall is not None:
+            return
+        self.wall = time.perf_counter() - self.start
+        self.cpu = time.thread_time() - self._cpu + _children_cpu() - self._children
+        # a non-zero exit code is a failure even if nothing was raised
+        self.status = status or (FAILED if self.args.get("rc") else OK)
+        if TRACE:
+            tracer.record(self)
+
+    def to_event(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "cat": self.cat,
+            "ph": "X",
+            "ts": round((self.start - _origin) * 1e6),
+            "dur": round((self.wall or 0) * 1e6),
+            "pid": os.getpid(),
+            "tid": self.tid,
+            "args": self.args
+            | {"status": self.status, "cpu_ms": round((self.cpu or 0) * 1e3, 3)},
+        }
+
+
+class Tracer:
+    """The spans of this process."""
+
+    spans: list[Span]
+
+    def __init__(self):
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def record(self, span: Span):
+        with self.lock:
+            self.spans.append(span)
+
+    def to_dict(self) -> dict[str, Any]:
+        with self.lock:
+            spans = list(self.spans)
+        return {
+            "traceEvents": [span.to_event() for span in spans],
+            "displayTimeUnit": "ms",
+        }
+
+    def export(self, path: str):
+        import json
+
+        tmp = f"{path}.{os.getpid()}"
+        with open(tmp, "w") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp, path)
+
+    def summary(self) -> str:
+        """
+        Returns a table of the spans by category and name, slowest first
+        """
+        rows: dict[tuple[str, str], list] = {}
+        with self.lock:
+            for span in self.spans:
+                row = rows.setdefault((span.cat, span.name), [0, 0.0, 0.0, 0])
+                row[0] += 1
+                row[1] += span.wall or 0
+                row[2] += span.cpu or 0
+                row[3] += span.status != OK
+        width = max([len(f"{cat} {name}") for cat, name in rows] + [4])
+        lines = [f"{'span':<{width}}  {'calls':>5}  {'wall s':>8}  {'cpu s':>8}  failed"]
+        for (cat, name), (calls, wall, cpu, failed) in sorted(
+            rows.items(), key=lambda item: -item[1][1]
+        ):
+            row = f"{f'{cat} {name}':<{width}}  {calls:>5}  {wall:>8.3f}  {cpu:>8.3f}"
+            lines.append(f"{row}  {failed}" if failed else row)
+        return "\n".join(lines)
+
+
+tracer = Tracer()
+
+
+@contextlib.contextmanager
+def span(name: str, cat: str = "stellar", **args) -> Iterator[Span]:
+    s = Span(name, cat, **args)
+    try:
+        yield s
+    except BaseException as e:
+        s.set(error=f"{type(e).__name__}: {e}")
+        s.end(ERROR)
+        raise
+    s.end()
+
+
+def traced(name: str, cat: str = "stellar") -> Callable[[Callable], Callable]:
+    """
+    Returns a decorator that runs the function in a span
+    """
+
+    def decorator(f: Callable) -> Callable:
+        @functools.wraps(f)
+        def inner(*args, **kwargs):
+            with span(name, cat):
+                return f(*args, **kwargs)
+
+        return inner
+
+    return decorator
+
+
+class Phases:
+    """
+    Spans for the phases of a command, each one ending when the next begins
+    """
+
+    def __init__(self, cat: str):
+        self.cat = cat
+        self.current: Span | None = None
+
+    def enter(self, phase: str):
+        if self.current and self.current.args["phase"] == phase:
+            return
+        if self.current:
+            self.current.end(OK)
+        self.current = Span(phase, self.cat, phase=phase)
+
+    def close(self, rc: int):
+        # only the phase it stopped in failed
+        if self.current:
+            self.current.set(rc=rc)
+            self.current.end()
+            self.current = None
+
+
+def child_path(name: str) -> str | None:
+    """
+    Returns where a child process should write its own trace
+    """
+    if not TRACE:
+        return None
+    base, ext = os.path.splitext(TRACE)
+    return f"{base}-{name}{ext or '.json'}"
+
+
+def _finish():
+    if not tracer.spans:
+        return
+    import logging
+
+    try:
+        tracer.export(TRACE)
+    except OSError as e:
+        logging.warning(f"Cannot write trace {TRACE}: {e}")
+    else:
+        logging.info(f"Trace written to {TRACE}")
+    logging.info("Time spent:\n" + tracer.summary())
+
+
+if TRACE:
+    atexit.register(_finish)
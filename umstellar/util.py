@@ -1,69 +1,314 @@
+import atexit
+import contextlib
+import itertools
+import json
+import logging
 import os
+import shlex
 import subprocess
+import sys
+import tempfile
 import threading
+from queue import Queue
+from typing import Callable
+
+from . import helper
+
 # from gi.repository import Gtk, GObject
 # Run payload in either the a chroot as a temporary script, or run directly on the host
 
 
-def execute(payload: str):
+class Executor:
     """
-    This function accepts a string, and executes it as a script
+    A long-lived privileged helper (see helper.py) that runs scripts for us.
+
+    It is authorized once, and then every script goes through the same
+    process, either on the host or inside STELLAR_CHROOT. Several scripts
+    can be in flight at the same time.
     """
-    # Check if there's an envar called STELLAR_CHROOT
-    if os.environ.get("STELLAR_CHROOT"):
-        print("Running in chroot...")
-        chroot = os.environ.get("STELLAR_CHROOT")
-        # first, check the string if there's a shebang
 
-        pl = payload
+    def __init__(self, root: str | None = None):
+        cmd = [sys.executable, helper.__file__]
+        if root:
+            cmd.extend(["--root", root])
+        if os.geteuid() != 0:
+            cmd.insert(0, "pkexec")
+        self.proc = subprocess.Popen(
+            cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+        )
+        assert self.proc.stdin
+        assert self.proc.stdout
+        # the helper says hi once it's authorized (and chrooted)
+        if not (line := self.proc.stdout.readline()) or not json.loads(line)["ready"]:
+            self.proc.wait()
+            raise RuntimeError(f"privileged helper exited with {self.proc.returncode}")
+        self._ids = itertools.count()
+        self._pending: dict[int, Queue[dict]] = {}
+        self._lock = threading.Lock()
+        # set once the helper is gone (crashed, killed), nothing answers then
+        self.dead = False
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
 
-        if not pl.startswith("#!"):
-            # prepend shebang
-            pl = "#!/bin/sh\n" + pl
+    def _read(self):
+        assert self.proc.stdout
+        try:
+            for line in self.proc.stdout:
+                msg = json.loads(line)
+                with self._lock:
+                    q = self._pending.get(msg["id"])
+                if q:
+                    q.put(msg)
+        finally:
+            # the helper is gone, don't leave anyone waiting forever
+            with self._lock:
+                self.dead = True
+                for q in self._pending.values():
+                    q.put({"rc": 255})
 
-        # Now, write the payload to a temporary file
-        tmpfile = os.path.join(chroot, "tmp", "stellar-payload.sh")
+    def _request(self, req: dict, on_output: Callable[[str], None]) -> int:
+        assert self.proc.stdin
+        q: Queue[dict] = Queue()
+        with self._lock:
+            if self.dead:
+                return 255
+            rcid = next(self._ids)
+            try:
+                self.proc.stdin.write(json.dumps({"id": rcid, **req}) + "\n")
+                self.proc.stdin.flush()
+            except OSError as e:
+                logging.error(f"Privileged helper is gone: {e}")
+                self.dead = True
+                return 255
+            self._pending[rcid] = q
+        while "rc" not in (msg := q.get()):
+            on_output(msg["out"])
+        with self._lock:
+            self._pending.pop(rcid)
+        return msg["rc"]
 
-        os.makedirs(os.path.dirname(tmpfile), exist_ok=True)
+    def run(
+        self,
+        script: str,
+        env: dict[str, str] | None = None,
+        on_output: Callable[[str], None] = sys.stdout.write,
+    ) -> int:
+        """
+        Runs a script through the helper and returns its exit code
+        """
+        return self._request({"script": script, "env": env or {}}, on_output)
 
-        with open(tmpfile, "w") as f:
-            f.write(pl)
+    def write(
+        self,
+        path: str,
+        data: str,
+        mode: int = 0o644,
+        on_output: Callable[[str], None] = sys.stdout.write,
+    ) -> int:
+        """
+        Writes a file through the helper, returns 0 if that worked
+        """
+        return self._request({"write": path, "data": data, "mode": mode}, on_output)
 
-        # chmod +x the temporary file
+    def close(self):
+        with self._lock:
+            if self.proc.stdin and not self.proc.stdin.closed:
+                # a dead helper's pipe can't take the flush that comes with
+                # closing it
+                with contextlib.suppress(OSError):
+                    self.proc.stdin.close()
+        self.proc.wait()
 
-        os.chmod(tmpfile, 0o755)
 
-        # finally execute the script
+_executor: Executor | None = None
+# set once the helper failed to start, so we don't ask for a password again
+# for every script
+_executor_failed = False
+_executor_lock = threading.Lock()
 
-        proc = subprocess.Popen(f"chroot {chroot} /tmp/stellar-payload.sh", shell=True)
 
-        p = proc.wait()
+def get_executor() -> Executor | None:
+    """
+    Returns the shared privileged helper, starting it on first use
 
-        # remove the temporary file
-        os.remove(tmpfile)
+    Returns None if the helper can't be started (e.g. no pkexec) or died,
+    in which case scripts are run the old way, one process per script.
+    """
+    global _executor, _executor_failed
+    with _executor_lock:
+        if _executor_failed:
+            return None
+        if _executor is not None and _executor.dead:
+            # what's left runs the old way, one process per script
+            logging.warning(
+                f"Privileged helper exited with {_executor.proc.poll()}, "
+                "running the rest without it"
+            )
+            _executor_failed = True
+            return None
+        if _executor is None:
+            try:
+                _executor = Executor(os.environ.get("STELLAR_CHROOT"))
+            except Exception as e:
+                logging.warning(f"Cannot start privileged helper: {e}")
+                _executor_failed = True
+                return None
+            atexit.register(_executor.close)
+        return _executor
+
+
+def payload_env() -> dict[str, str]:
+    # pkexec doesn't pass our environment along, so the helper gets the
+    # variables scripts care about with every request
+    return {k: v for k, v in os.environ.items() if k.startswith("STELLAR_")}
+
+
+# Things running side by side write whole lines under this lock, so their
+# output doesn't get mixed up mid-line
+print_lock = threading.Lock()
+
+
+def prefixed(prefix: str, sink=sys.stdout) -> Callable[[str], None]:
+    """
+    Returns an on_output function writing every line with a prefix
+    """
+
+    def write(text: str):
+        lines = "".join(f"{prefix}{line}\n" for line in text.splitlines())
+        with print_lock:
+            sink.write(lines)
+            sink.flush()
+
+    return write
+
+
+def privileged(cmd: list[str]) -> list[str]:
+    """
+    Returns the command wrapped to run as root on the system being set up
+    """
+    # same as execute(): in kickstart mode we're root already and the
+    # target is STELLAR_CHROOT, otherwise it's the host
+    if root := os.environ.get("STELLAR_CHROOT"):
+        return ["chroot", root, *cmd]
+    return ["sudo", *cmd]
 
-    else:
-        print("Running on host...")
-        # Run the payload directly on the host
-        pl = payload
 
-        if not pl.startswith("#!"):
-            # prepend shebang
-            pl = "#!/bin/sh\n" + pl
+def authorize() -> bool:
+    """
+    Asks for the sudo password once, before dnf5 and flatpak start side by
+    side, so two prompts don't fight over the terminal. Returns False if
+    that didn't work
+    """
+    if os.environ.get("STELLAR_CHROOT") or os.geteuid() == 0:
+        return True
+    try:
+        return subprocess.run(["sudo", "-v"]).returncode == 0
+    except OSError as e:
+        logging.error(f"Cannot run sudo: {e}")
+        return False
 
-        # Now, write the payload to a temporary file
 
-        tmpfile = "/tmp/stellar-payload.sh"
+def execute(
+    payload: str,
+    env: dict[str, str] | None = None,
+    on_output: Callable[[str], None] | None = None,
+) -> int:
+    """
+    This function accepts a string, and executes it as a script
+    """
+    if env is None:
+        env = payload_env()
+    if executor := get_executor():
+        return executor.run(payload, env, on_output or sys.stdout.write)
+    return execute_oneshot(payload, env, on_output)
 
-        with open(tmpfile, "w") as f:
-            f.write(pl)
 
-        os.chmod(tmpfile, 0o755)
+def write_file(path: str, data: str, mode: int = 0o644) -> int:
+    """
+    Writes a file on the system being set up, returns 0 if that worked
 
-        # proc = subprocess.Popen(payload, shell=True)
-        # Run script with pkexec
+    The path is absolute within the target, so /etc/foo ends up in
+    STELLAR_CHROOT/etc/foo in kickstart mode.
+    """
+    if os.geteuid() == 0:
+        root = os.environ.get("STELLAR_CHROOT") or "/"
+        full = os.path.join(root, path.lstrip("/"))
+        try:
+            os.makedirs(os.path.dirname(full), exist_ok=True)
+            tmp = f"{full}.stellar-tmp"
+            with open(tmp, "w") as f:
+                f.write(data)
+            os.chmod(tmp, mode)
+            os.replace(tmp, full)
+        except OSError as e:
+            logging.error(f"Cannot write {full}: {e}")
+            return 1
+        return 0
+    if executor := get_executor():
+        return executor.write(path, data, mode)
+    # the end marker has to be on a line of its own
+    if not data.endswith("\n"):
+        data += "\n"
+    return execute_oneshot(
+        f"cat > {shlex.quote(path)} <<'STELLAR_EOF'\n{data}STELLAR_EOF\n"
+        f"chmod {mode:o} {shlex.quote(path)}\n"
+    )
 
-        proc = subprocess.Popen(f"pkexec {tmpfile}", shell=True)
 
-        p = proc.wait()
-        return p
+def execute_oneshot(
+    payload: str,
+    env: dict[str, str] | None = None,
+    on_output: Callable[[str], None] | None = None,
+) -> int:
+    """
+    Executes a script in its own process, without the privileged helper
+    """
+    env = env or {}
+    # first, check the string if there's a shebang
+    pl = payload
+    if not pl.startswith("#!"):
+        # prepend shebang
+        pl = "#!/bin/sh\n" + pl
+
+    # Check if there's an envar called STELLAR_CHROOT
+    if chroot := os.environ.get("STELLAR_CHROOT"):
+        print("Running in chroot...")
+        tmpdir = os.path.join(chroot, "tmp")
+    else:
+        print("Running on host...")
+        tmpdir = "/tmp"
+
+    # Now, write the payload to a temporary file, with its own name since
+    # several scripts can run at once
+    os.makedirs(tmpdir, exist_ok=True)
+    fd, tmpfile = tempfile.mkstemp(prefix="stellar-payload-", suffix=".sh", dir=tmpdir)
+    with os.fdopen(fd, "w") as f:
+        f.write(pl)
+    os.chmod(tmpfile, 0o755)
+
+    if chroot:
+        # we're root already, so the environment just gets passed along
+        cmd = ["chroot", chroot, os.path.join("/tmp", os.path.basename(tmpfile))]
+    else:
+        # Run script with pkexec, which drops our environment, so it goes
+        # back in through env(1)
+        cmd = ["pkexec", "env", *(f"{k}={v}" for k, v in env.items()), tmpfile]
+
+    try:
+        if on_output is None:
+            return subprocess.Popen(cmd, env=os.environ | env).wait()
+        proc = subprocess.Popen(
+            cmd,
+            env=os.environ | env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors="replace",
+        )
+        assert proc.stdout
+        for line in proc.stdout:
+            on_output(line)
+        return proc.wait()
+    finally:
+        # remove the temporary file
+        os.remove(tmpfile)
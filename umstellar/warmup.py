@@ -0,0 +1,173 @@
+# Background metadata warm-up
+#
+# While the user is still picking apps, the repo metadata and the flatpak
+# appstream data get refreshed in the background, at idle CPU and I/O
+# priority. By the time the install starts the caches are fresh, so dnf5 and
+# flatpak can go straight to resolving.
+#
+# The installer waits for a warm-up that's still running instead of starting
+# a second refresh next to it, and Skip cancels it.
+import logging
+import subprocess
+import threading
+import time
+
+from . import util
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# lowest CPU and I/O priority, so the GUI stays snappy
+IDLE = ["nice", "-n", "19", "ionice", "-c", "3"]
+
+
+class Task:
+    """One background refresh command."""
+
+    name: str
+    cmd: list[str]
+    state: str
+    rc: int | None
+    elapsed: float | None
+
+    def __init__(self, name: str, cmd: list[str]):
+        self.name = name
+        self.cmd = cmd
+        self.state = PENDING
+        self.rc = None
+        self.elapsed = None
+        self.proc: subprocess.Popen | None = None
+        self.finished = threading.Event()
+
+    def __repr__(self):
+        return f"Task(name={self.name}, state={self.state}, rc={self.rc})"
+
+    def run(self, cancelled: threading.Event):
+        start = time.monotonic()
+        try:
+            if cancelled.is_set():
+                self.state = CANCELLED
+                return
+            self.state = RUNNING
+            self.proc = subprocess.Popen(
+                self.cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                stdin=subprocess.DEVNULL,
+                text=True,
+                errors="replace",
+            )
+            if cancelled.is_set():
+                # cancelled while it was starting
+                self.proc.terminate()
+            assert self.proc.stdout
+            for line in self.proc.stdout:
+                logging.debug(f"warmup {self.name}: {line.rstrip()}")
+            self.rc = self.proc.wait()
+            if cancelled.is_set():
+                self.state = CANCELLED
+            else:
+                self.state = DONE if self.rc == 0 else FAILED
+        except OSError as e:
+            logging.warning(f"Cannot warm up {self.name}: {e}")
+            self.state = FAILED
+        finally:
+            self.elapsed = time.monotonic() - start
+            if self.state != CANCELLED:
+                logging.info(f"Warm-up of {self.name} {self.state} in {self.elapsed:.1f}s")
+            self.finished.set()
+
+
+class Warmup:
+    """The background refreshes for this session."""
+
+    tasks: list[Task]
+
+    def __init__(self, tasks: list[Task]):
+        self.tasks = tasks
+        self.cancelled = threading.Event()
+
+    def start(self):
+        for task in self.tasks:
+            threading.Thread(
+                target=task.run,
+                args=[self.cancelled],
+                name=f"stellar-warmup-{task.name}",
+                daemon=True,
+            ).start()
+
+    def cancel(self):
+        self.cancelled.set()
+        for task in self.tasks:
+            if task.proc and task.proc.poll() is None:
+                task.proc.terminate()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """
+        Waits for every task to finish, returns False on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for task in self.tasks:
+            left = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if not task.finished.wait(left):
+                return False
+        return True
+
+    def state(self, name: str) -> str | None:
+        return next((task.state for task in self.tasks if task.name == name), None)
+
+
+# the warm-up for this session, if one was started
+current: Warmup | None = None
+_lock = threading.Lock()
+
+
+def background(cmd: list[str]) -> list[str]:
+    """
+    Returns the command wrapped to run as root, at idle priority, without
+    ever asking for a password
+    """
+    cmd = util.privileged([*IDLE, *cmd])
+    if cmd[0] == "sudo":
+        # nobody is there to type a password for a background job
+        cmd.insert(1, "--non-interactive")
+    return cmd
+
+
+def start() -> Warmup:
+    """
+    Starts the warm-up, unless it's already going
+    """
+    global current
+    with _lock:
+        if current is None:
+            current = Warmup(
+                [
+                    Task("dnf5", background(["dnf5", "makecache", "-y"])),
+                    Task(
+                        "flatpak",
+                        background(["flatpak", "update", "--appstream", "--noninteractive"]),
+                    ),
+                ]
+            )
+            current.start()
+        return current
+
+
+def cancel():
+    if current is not None:
+        current.cancel()
+
+
+def wait(timeout: float | None = None) -> bool:
+    """
+    Waits for the warm-up if one was started, returns False on timeout
+    """
+    if current is None:
+        return True
+    if not all(task.finished.is_set() for task in current.tasks):
+        logging.info("Waiting for the background metadata refresh to finish")
+    return current.wait(timeout)